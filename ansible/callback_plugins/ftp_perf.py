@@ -0,0 +1,122 @@
+"""
+Aggregate the ``perf`` key reported by the ``ftp`` action plugin and print,
+at the end of the playbook, where provisioning time went per host and per
+phase.
+"""
+
+from collections import defaultdict
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = """
+    name: ftp_perf
+    type: aggregate
+    short_description: per-host and per-phase timing summary for the ftp plugin
+    description:
+      - Collects the C(perf) result key of every C(ftp) task and prints the
+        slowest hosts and phases once the playbook finishes.
+    requirements:
+      - enable in configuration (C(callbacks_enabled = ftp_perf))
+"""
+
+# Plugin phase each companion module mode runs inside. The module's own
+# step timings are a breakdown of that phase, not phases of their own, and
+# apply overlaps its database step with the filesystem steps.
+REMOTE_PARENT_PHASES = {
+    "snapshot": "gather_configuration_vars",
+    "apply": "apply_provisioning",
+}
+
+
+def _host_entry():
+    return dict(
+        tasks=0,
+        users=0,
+        seconds=0.0,
+        module_runs=0,
+        db_statements=0,
+        phases=defaultdict(float),
+        remote=defaultdict(float),
+    )
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "ftp_perf"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super().__init__()
+        self._hosts = defaultdict(_host_entry)
+
+    def _record(self, result):
+        # Looped tasks carry one perf dict per item under "results".
+        items = result._result.get("results") or [result._result]
+        for item in items:
+            perf = item.get("perf") if isinstance(item, dict) else None
+            if not isinstance(perf, dict):
+                continue
+            host = self._hosts[result._host.get_name()]
+            host["tasks"] += 1
+            host["users"] += perf.get("users", 0)
+            host["seconds"] += perf.get("total_seconds", 0.0)
+            host["module_runs"] += perf.get("module_runs", 0)
+            host["db_statements"] += perf.get("db_statements", 0)
+            for name, phase in perf.get("phases", {}).items():
+                host["phases"][name] += phase.get("seconds", 0.0)
+            for mode, steps in perf.get("remote", {}).items():
+                for step, seconds in steps.items():
+                    host["remote"][(mode, step)] += seconds
+
+    def v2_runner_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result)
+
+    def v2_playbook_on_stats(self, stats):
+        if not self._hosts:
+            return
+
+        self._display.banner("FTP PERF BY HOST")
+        self._display.display(
+            f"{'host':<32} {'tasks':>5} {'users':>7} {'total s':>9} "
+            f"{'ms/user':>8} {'modules':>7} {'stmts':>6}  slowest phase"
+        )
+        hosts = sorted(self._hosts.items(), key=lambda h: -h[1]["seconds"])
+        for name, host in hosts:
+            per_user = 1000 * host["seconds"] / host["users"] if host["users"] else 0
+            slowest = max(host["phases"].items(), key=lambda p: p[1], default=("-", 0))
+            self._display.display(
+                f"{name:<32} {host['tasks']:>5} {host['users']:>7} "
+                f"{host['seconds']:>9.3f} {per_user:>8.2f} "
+                f"{host['module_runs']:>7} {host['db_statements']:>6}  "
+                f"{slowest[0]} ({slowest[1]:.3f}s)"
+            )
+
+        phases = defaultdict(float)
+        for host in self._hosts.values():
+            for name, seconds in host["phases"].items():
+                phases[name] += seconds
+        total = sum(h["seconds"] for h in self._hosts.values()) or 1.0
+
+        self._display.banner("FTP PERF BY PHASE")
+        for name, seconds in sorted(phases.items(), key=lambda p: -p[1]):
+            self._display.display(
+                f"{name:<40} {seconds:>9.3f}s {100 * seconds / total:>6.1f}%"
+            )
+
+        remote = defaultdict(float)
+        for host in self._hosts.values():
+            for key, seconds in host["remote"].items():
+                remote[key] += seconds
+        if not remote:
+            return
+        # No percentages: the steps are inside their phase and may overlap.
+        self._display.banner("FTP PERF REMOTE STEPS (within their phase)")
+        for (mode, step), seconds in sorted(
+            remote.items(), key=lambda r: (r[0][0], -r[1])
+        ):
+            parent = REMOTE_PARENT_PHASES.get(mode, mode)
+            self._display.display(f"{parent + ' > ' + step:<40} {seconds:>9.3f}s")
@@ -14,7 +14,11 @@ import re
 from ansible.plugins.action import ActionBase
 from ansible.errors import AnsibleError, AnsibleActionFail
 from ansible.module_utils._text import to_text
-import base64
+from contextlib import contextmanager
+import hashlib
+import os
+import time
+import hash_cache
 import sha512crypt
 
 
@@ -25,6 +29,24 @@ SENSITIVE_KEY_PAT = re.compile(
     re.IGNORECASE,
 )
 
+USER_REQUIRED_ARGS = ["username", "password", "webroot"]
+
+STATES = ("present", "absent")
+
+# How removed accounts are dropped from the users table. Their vsftpd file
+# is always deleted; webroots are never touched.
+ABSENT_MODES = ("delete", "deactivate")
+
+# What to do about the users table layout before touching any rows:
+# nothing, warn about missing columns/indexes, or add them.
+SCHEMA_MODES = ("ignore", "verify", "migrate")
+
+# Companion module in the role's library/ doing all host-side work.
+PROVISION_MODULE = "ftp_provision"
+
+# Optional task args handed to the companion module unchanged.
+PASSTHROUGH_ARGS = ["vsftpd_conf", "pam_dir", "db_pam_service", "webroot_repair"]
+
 
 def _safe_identifier(s: str) -> str:
     if not re.fullmatch(r"[A-Za-z0-9._-]{1,64}", s):
@@ -32,8 +54,35 @@ def _safe_identifier(s: str) -> str:
     return s
 
 
-def _safe_sql_literal(s: str) -> str:
-    return s.replace("'", "''")
+def _row_state(row) -> str:
+    if row is None:
+        return "absent"
+    return "active" if row["active"] else "inactive"
+
+
+def _path_state(st) -> str:
+    if st is None:
+        return "absent"
+    out = f"{st['owner']}:{st['group']} {st['mode']}"
+    if "checksum" in st:
+        out += f" sha1:{st['checksum']}"
+    return out
+
+
+def _censor_users(users: list) -> list:
+    censored = []
+    for item in users:
+        if isinstance(item, dict):
+            item = {
+                k: (
+                    "VALUE_SPECIFIED_IN_NO_LOG_PARAMETER"
+                    if SENSITIVE_KEY_PAT.search(str(k))
+                    else v
+                )
+                for k, v in item.items()
+            }
+        censored.append(item)
+    return censored
 
 
 class ActionModule(ActionBase):
@@ -43,26 +92,115 @@ class ActionModule(ActionBase):
         result = super(ActionModule, self).run(tmp, task_vars)
         del tmp
         args = self._task.args
+        started = time.monotonic()
+        self._perf = dict(phases={}, remote={}, module_runs=0, db_statements=0)
 
         try:
             self._validate_required_args(args, result)
-            conf_vars = self._gather_configuration_vars(task_vars, result)
-
-            changed = False
-            changed |= self._update_ftp_user_cred_in_database(
-                args, conf_vars, task_vars, result
-            )
-            changed |= self._ensure_webroot_directory(
-                args, conf_vars, task_vars, result
-            )
-            changed |= self._create_vsftpd_user_config_file(
-                args, conf_vars, task_vars, result
-            )
-
-            result.update(
-                changed=changed,
-                msg=f"FTP user {args['username']} created/updated with webroot: {args['webroot']}",
+            state = args["state"]
+            exclusive = bool(args.get("exclusive", False))
+            users = self._normalize_users(args, state)
+            self._perf["users"] = len(users)
+            with self._phase("gather_configuration_vars"):
+                snapshot = self._gather_configuration_vars(
+                    users, exclusive, task_vars, result
+                )
+
+            schema_changed = self._report_schema(snapshot.get("schema"), result)
+
+            if state == "absent":
+                present, removals = [], [user["username"] for user in users]
+            else:
+                present = users
+                removals = (
+                    self._stale_accounts(users, snapshot, args) if exclusive else []
+                )
+
+            if self._task.check_mode:
+                # Predict from the read-only snapshot alone: no hashing and
+                # no apply run, so stored passwords are not verified.
+                credentials = None
+                with self._phase("plan_changes"):
+                    outcome = self._plan_changes(present, removals, snapshot, None)
+            else:
+                with self._phase("sha512_crypt"):
+                    credentials = self._hash_pending_credentials(
+                        present, snapshot["rows"], removals, task_vars, result
+                    )
+                with self._phase("apply_provisioning"):
+                    outcome = self._apply_provisioning(
+                        present, credentials, removals, snapshot, task_vars, result
+                    )
+                result["steps"] = outcome.get("steps", {})
+                if "userdb" in outcome:
+                    result["userdb"] = outcome["userdb"]
+                    service = outcome["userdb"].get("pam_service")
+                    if service and not service["in_use"]:
+                        # vsftpd.conf is the role's; see ftp_pam_service_name.
+                        result.setdefault("warnings", []).append(
+                            f"PAM service {service['name']} is written but "
+                            "vsftpd.conf does not use it yet: set "
+                            f"ftp_pam_service_name: {service['name']} for the "
+                            "ftp role (and keep db_pam_service on this task)"
+                        )
+
+            if self._task.diff:
+                result["diff"] = self._plan_changes(
+                    present, removals, snapshot, credentials
+                )["diff"]
+                if schema_changed:
+                    result["diff"].insert(
+                        0,
+                        dict(
+                            before_header="users table",
+                            after_header="users table (migrated)",
+                            before="",
+                            after="".join(
+                                f"{c}\n" for c in snapshot["schema"]["changes"]
+                            ),
+                        ),
+                    )
+
+            user_results = [
+                dict(
+                    username=user["username"],
+                    webroot=user["webroot"],
+                    state="present",
+                    changed=any(outcome["users"][user["username"]].values()),
+                )
+                for user in present
+            ] + [
+                dict(
+                    username=username,
+                    state="absent",
+                    changed=any(outcome["removed"][username].values()),
+                )
+                for username in removals
+            ]
+
+            changed = (
+                schema_changed
+                or result.get("userdb", {}).get("changed", False)
+                or any(u["changed"] for u in user_results)
             )
+            if "users" in args:
+                result.update(
+                    changed=changed,
+                    users=user_results,
+                    msg=f"{len(present)} FTP users created/updated, "
+                    f"{len(removals)} removed, "
+                    f"{sum(u['changed'] for u in user_results)} changed",
+                )
+            elif state == "absent":
+                result.update(
+                    changed=changed,
+                    msg=f"FTP user {args['username']} removed",
+                )
+            else:
+                result.update(
+                    changed=changed,
+                    msg=f"FTP user {args['username']} created/updated with webroot: {args['webroot']}",
+                )
 
         except AnsibleActionFail as ex:
             result.setdefault("failed", True)
@@ -77,26 +215,20 @@ class ActionModule(ActionBase):
             self._ensure_invocation(result)
             raise AnsibleActionFail(message=result["msg"], result=result, orig_exc=ex)
 
+        self._perf["total_seconds"] = time.monotonic() - started
+        result["perf"] = self._perf
         self._ensure_invocation(result)
         return result
 
-    VAR_PATTERNS = {
-        "ftp_guest_user": re.compile(
-            r"^\s*(?:guest_username|ftp_username|chown_username)\s*=\s*(\S+)",
-            re.MULTILINE,
-        ),
-        "ftp_users_dir": re.compile(r"^\s*user_config_dir\s*=\s*(\S+)", re.MULTILINE),
-        "pam_service_name": re.compile(
-            r"^\s*pam_service_name\s*=\s*(\S+)", re.MULTILINE
-        ),
-    }
-
-    PAM_PATTERNS = {
-        "db_login_user": re.compile(r"\buser=([^\s]+)"),
-        "db_login_password": re.compile(r"\bpasswd=([^\s]+)"),
-        "db_name": re.compile(r"\bdb=([^\s]+)"),
-        "db_host": re.compile(r"\bhost=([^\s]+)"),
-    }
+    @contextmanager
+    def _phase(self, name):
+        """Accumulate monotonic wall time of a plugin phase into ``perf``."""
+        phase = self._perf["phases"].setdefault(name, dict(seconds=0.0))
+        start = time.monotonic()
+        try:
+            yield phase
+        finally:
+            phase["seconds"] += time.monotonic() - start
 
     def _ensure_invocation(self, result):
         if self._task.no_log:
@@ -114,184 +246,431 @@ class ActionModule(ActionBase):
                 invocation[key] = f"CENSORED: {key} is a no_log parameter"
                 if key in module_args:
                     module_args[key] = "VALUE_SPECIFIED_IN_NO_LOG_PARAMETER"
+            elif key == "users" and isinstance(value, list):
+                invocation[key] = module_args[key] = _censor_users(value)
 
         for k, v in result.items():
             if SENSITIVE_KEY_PAT.search(str(k)):
                 result[k] = "VALUE_SPECIFIED_IN_NO_LOG_PARAMETER"
         return result
 
-    def _mysql_query(self, task_vars, **kwargs):
-        return self._execute_module(
-            module_name="community.mysql.mysql_query",
-            module_args=kwargs,
-            task_vars=task_vars,
-        )
-
-    def _ensure_dir(self, task_vars, path, owner, group, mode):
-        return self._execute_module(
-            module_name="ansible.builtin.file",
-            module_args=dict(
-                path=path, state="directory", owner=owner, group=group, mode=mode
-            ),
+    def _provision(self, task_vars, result, **module_args):
+        """Run the companion module once and surface its failures."""
+        for key in PASSTHROUGH_ARGS:
+            if key in self._task.args:
+                module_args[key] = self._task.args[key]
+        exec_result = self._execute_module(
+            module_name=PROVISION_MODULE,
+            module_args=module_args,
             task_vars=task_vars,
         )
+        self._perf["module_runs"] += 1
+        self._perf["db_statements"] += exec_result.get("db_statements", 0)
+        if "timings" in exec_result:
+            self._perf["remote"][module_args["mode"]] = exec_result["timings"]
 
-    def _copy_file(self, task_vars, dest, content, owner, group, mode):
-        # Build the args dict exactly like a normal task would see them
-        copy_args = dict(
-            dest=dest, content=content, owner=owner, group=group, mode=mode
-        )
-        copy_task = self._task.copy()
-        copy_task.args = copy_args
-
-        # Delegate to the actual copy ActionModule implementation
-        return self._shared_loader_obj.action_loader.get(
-            "ansible.builtin.copy",
-            task=copy_task,
-            connection=self._connection,
-            play_context=self._play_context,
-            loader=self._loader,
-            templar=self._templar,
-            shared_loader_obj=self._shared_loader_obj,
-        ).run(task_vars=task_vars)
-
-    def _read_remote_file(self, task_vars, path, result: dict):
-        res = self._execute_module(
-            module_name="ansible.builtin.slurp",
-            module_args={"src": path},
-            task_vars=task_vars,
-        )
-        result.update(res)
-        if res.get("failed"):
-            raise AnsibleActionFail(
-                message=f"ansible.builtin.slurp: {result.get("msg")}",
-                orig_exc=result.get("exception"),
-                result=result,
-            )
-        return base64.b64decode(res["content"]).decode("utf-8", errors="replace")
-
-    def _parse_vars(self, text, patterns):
-        out = {}
-        for key, pat in patterns.items():
-            m = pat.search(text)
-            if m:
-                out[key] = m.group(1)
-            else:
-                raise ConfigVarMissingError(key)
-        return out
+        if exec_result.get("failed"):
+            if exec_result.get("config_missing"):
+                raise ConfigVarMissingError(
+                    exec_result["config_missing"], source=exec_result.get("source")
+                )
+            # The module traceback is already in result["exception"].
+            result.update(exec_result)
+            raise AnsibleActionFail(message=result.get("msg"), result=result)
+        return exec_result
 
     def _validate_required_args(self, args, result):
         """Validate that all required arguments are present."""
-        required = ["username", "password", "webroot", "state"]
+        state = args.get("state")
+        if "users" in args:
+            required = ["users", "state"]
+        elif state == "absent":
+            required = ["username", "state"]
+        else:
+            required = USER_REQUIRED_ARGS + ["state"]
         missing = [r for r in required if r not in args]
         if missing:
             self._ensure_invocation(result)
             raise AnsibleActionFail(
                 message=f"Missing required args: {', '.join(missing)}"
             )
+        if state not in STATES:
+            raise AnsibleActionFail(
+                message=f"state must be one of {', '.join(STATES)}, got: {state}"
+            )
+        if args.get("exclusive") and state != "present":
+            raise AnsibleActionFail(message="exclusive requires state=present")
+        if args.get("absent_mode", "delete") not in ABSENT_MODES:
+            raise AnsibleActionFail(
+                message=f"absent_mode must be one of {', '.join(ABSENT_MODES)}"
+            )
+        if args.get("userdb_pam_service") and not args.get("userdb"):
+            raise AnsibleActionFail(message="userdb_pam_service requires userdb")
+        if args.get("userdb") and not os.path.isabs(args["userdb"]):
+            raise AnsibleActionFail(message="userdb must be an absolute path")
+        if args.get("schema", "ignore") not in SCHEMA_MODES:
+            raise AnsibleActionFail(
+                message=f"schema must be one of {', '.join(SCHEMA_MODES)}"
+            )
+        if "hash_cache_size" in args and (
+            not str(args["hash_cache_size"]).isdigit()
+            or int(args["hash_cache_size"]) < 1
+        ):
+            raise AnsibleActionFail(
+                message="hash_cache_size must be a positive integer"
+            )
+        if args.get("hash_cache") and not self._loader._vault.secrets:
+            raise AnsibleActionFail(
+                message="hash_cache is vault encrypted: run with a vault "
+                "password (--vault-id, --ask-vault-pass or vault_identity_list)"
+            )
 
-    def _gather_configuration_vars(self, task_vars, result):
-        """Collect all necessary configuration variables from system files."""
-
-        vsftpd_conf = self._read_remote_file(
-            task_vars, "/etc/vsftpd/vsftpd.conf", result
-        )
-        conf_vars = self._parse_vars(vsftpd_conf, self.VAR_PATTERNS)
-        pam_conf = self._read_remote_file(
-            task_vars, f"/etc/pam.d/{conf_vars['pam_service_name']}", result
+    def _normalize_users(self, args, state):
+        """Return the requested accounts as a list of user dicts.
+
+        A single-user task (``username``/``password``/``webroot``) is treated
+        as a batch of one, so the rest of the plugin only deals with lists.
+        Removals only need ``username``.
+        """
+        if "users" not in args:
+            items = [args]
+        elif isinstance(args["users"], list):
+            items = args["users"]
+        else:
+            raise AnsibleActionFail(message="'users' must be a list")
+
+        required = USER_REQUIRED_ARGS if state == "present" else ["username"]
+        users = []
+        seen = set()
+        for idx, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise AnsibleActionFail(message=f"users[{idx}] must be a dict")
+            missing = [r for r in required if r not in item]
+            if missing:
+                raise AnsibleActionFail(
+                    message=f"users[{idx}] missing required keys: {', '.join(missing)}"
+                )
+            uname = _safe_identifier(item["username"])
+            if uname in seen:
+                raise AnsibleActionFail(message=f"Duplicate username: {uname}")
+            seen.add(uname)
+            skeleton = item.get("webroot_skeleton", args.get("webroot_skeleton", {}))
+            if not isinstance(skeleton, dict) or any(
+                os.path.basename(name) != name or name in ("", ".", "..")
+                for name in skeleton
+            ):
+                raise AnsibleActionFail(
+                    message=f"users[{idx}]: webroot_skeleton must map plain "
+                    "file names to their content"
+                )
+            users.append(
+                dict(
+                    username=uname,
+                    password=to_text(item.get("password", "")),
+                    webroot=item.get("webroot"),
+                    skeleton={name: to_text(c) for name, c in skeleton.items()},
+                )
+            )
+        return users
+
+    def _gather_configuration_vars(self, users, exclusive, task_vars, result):
+        """Read the host configuration and the stored rows of ``users``.
+
+        One read-only module execution: vsftpd.conf and the PAM file are
+        parsed on the host, which also selects the existing rows and stats
+        the webroots and vsftpd files. With
+        ``exclusive`` it also lists every account in the ``users`` table and
+        every file in ``user_config_dir``; with ``webroot_repair`` in check
+        mode it counts the webroot entries an apply run would fix, and it
+        lists the ``webroot_skeleton`` files each webroot lacks. With
+        ``schema`` it first checks (or migrates) the users table layout.
+        """
+        return self._provision(
+            task_vars,
+            result,
+            mode="snapshot",
+            usernames=[user["username"] for user in users],
+            webroots=[user["webroot"] for user in users if user["webroot"]],
+            skeletons={
+                user["webroot"]: sorted(user["skeleton"])
+                for user in users
+                if user["webroot"] and user["skeleton"]
+            },
+            inventory=exclusive,
+            schema=self._task.args.get("schema", "ignore"),
         )
-        pam_vars = self._parse_vars(pam_conf, self.PAM_PATTERNS)
-        conf_vars.update(pam_vars)
-        return conf_vars
-
-    def _update_ftp_user_cred_in_database(
-        self, args, conf_vars, task_vars, result: dict
-    ):
-        """Update or create the FTP user in the database."""
-
-        salt = sha512crypt.generate_salt(16)
-        hashed = sha512crypt.sha512_crypt(args["password"], salt)
-        uname = _safe_identifier(args["username"])
 
-        q = (
-            "INSERT INTO users (username, password, active) "
-            f"VALUES ('{_safe_sql_literal(uname)}','{_safe_sql_literal(hashed)}',1) "
-            "ON DUPLICATE KEY UPDATE password=VALUES(password), active=1;"
+    def _report_schema(self, schema, result):
+        """Copy the schema check into ``result``.
+
+        Returns True if the users table was migrated, or would be in check
+        mode; with ``schema: verify`` missing pieces only become a warning.
+        """
+        if schema is None:
+            return False
+        result["schema"] = schema
+        if not schema["changes"]:
+            return False
+        if self._task.args.get("schema") == "verify":
+            result.setdefault("warnings", []).append(
+                "users table needs: " + ", ".join(schema["changes"])
+            )
+            return False
+        return True
+
+    @staticmethod
+    def _stale_accounts(users, snapshot, args):
+        """Accounts present on the host but not in the desired list.
+
+        When deactivating, rows that are already inactive and have no
+        vsftpd file left are done and not reported again.
+        """
+        desired = {user["username"] for user in users}
+        keep_inactive = args.get("absent_mode", "delete") == "deactivate"
+        found = {
+            name
+            for name, active in snapshot["accounts"].items()
+            if active or not keep_inactive
+        }
+        found |= set(snapshot["config_files"])
+        return sorted(found - desired)
+
+    def _hash_pending_credentials(self, users, rows, removals, task_vars, result):
+        """Return ``{username: hash}`` for users whose row has to be written.
+
+        Rows that exist, are active and whose stored hash verifies against
+        the requested password are left alone, so converge runs are
+        write-free. With ``hash_cache`` the hashes of earlier runs are
+        reused: a row still holding the cached hash needs no verification
+        and a row to be written gets the cached hash instead of a new one.
+        Removed accounts are dropped from the cache.
+        """
+        cache = self._open_hash_cache(result)
+        host = task_vars.get("inventory_hostname", "")
+        cached = {}
+        if cache is not None:
+            for user in users:
+                hashed = cache.get(host, user["username"], user["password"])
+                if hashed is not None:
+                    cached[user["username"]] = hashed
+            for username in removals:
+                cache.invalidate(host, username)
+
+        active = [
+            user
+            for user in users
+            if user["username"] in rows and rows[user["username"]]["active"] == 1
+        ]
+        current = {
+            user["username"]
+            for user in active
+            if cached.get(user["username"]) == rows[user["username"]]["password"]
+        }
+        to_verify = [user for user in active if user["username"] not in current]
+        verified = sha512crypt.verify_many(
+            (user["password"], rows[user["username"]]["password"])
+            for user in to_verify
         )
-
-        exec_result = self._mysql_query(
-            task_vars,
-            login_db=conf_vars["db_name"],
-            login_user=conf_vars["db_login_user"],
-            login_password=conf_vars["db_login_password"],
-            login_host=conf_vars["db_host"],
-            query=q,
+        unchanged = current | {
+            user["username"] for user, ok in zip(to_verify, verified) if ok
+        }
+
+        pending = [user for user in users if user["username"] not in unchanged]
+        fresh = [user for user in pending if user["username"] not in cached]
+        hashes = sha512crypt.hash_many(user["password"] for user in fresh)
+        credentials = {
+            user["username"]: cached[user["username"]]
+            for user in pending
+            if user["username"] in cached
+        }
+        credentials.update(
+            (user["username"], hashed) for user, hashed in zip(fresh, hashes)
         )
 
-        if exec_result.get("failed"):
-            result.update(exec_result)
-            raise AnsibleActionFail(
-                message=result.get("msg"),
-                orig_exc=result.get("exception"),
-                result=result,
+        phase = self._perf["phases"].setdefault("sha512_crypt", {})
+        phase.update(
+            verified=len(to_verify), hashed=len(fresh), backend=sha512crypt.BACKEND
+        )
+        if cache is not None:
+            # A stored hash that verifies is adopted, so the next run can
+            # skip verifying it too.
+            for user, ok in zip(to_verify, verified):
+                if ok:
+                    name = user["username"]
+                    cache.put(host, name, user["password"], rows[name]["password"])
+            for user in fresh:
+                cache.put(
+                    host,
+                    user["username"],
+                    user["password"],
+                    credentials[user["username"]],
+                )
+            try:
+                cache.save()
+            except OSError as ex:
+                result.setdefault("warnings", []).append(
+                    f"hash_cache not saved: {ex}"
+                )
+            phase["cache"] = cache.stats
+        return credentials
+
+    def _open_hash_cache(self, result):
+        """The task's ``hash_cache``, or None when not enabled or unusable."""
+        path = self._task.args.get("hash_cache")
+        if not path:
+            return None
+        try:
+            return hash_cache.HashCache(
+                os.path.expanduser(path),
+                self._loader._vault,
+                int(
+                    self._task.args.get(
+                        "hash_cache_size", hash_cache.DEFAULT_MAX_ENTRIES
+                    )
+                ),
             )
+        except OSError as ex:
+            result.setdefault("warnings", []).append(f"hash_cache not used: {ex}")
+            return None
 
-        return exec_result.get("changed", False)
-
-    def _ensure_webroot_directory(self, args, conf_vars, task_vars, result):
-        """Ensure the webroot directory exists with correct permissions."""
-        exec_result = self._ensure_dir(
+    def _apply_provisioning(
+        self, users, credentials, removals, snapshot, task_vars, result
+    ):
+        """Write rows, webroots and per-user vsftpd files, drop ``removals``.
+
+        Everything happens in one module run; all row changes share one
+        transaction. Only vsftpd files whose checksum or metadata in the
+        snapshot differ from the rendered ones are sent. With ``userdb``
+        the active accounts are then exported for pam_userdb.
+        """
+        guest = snapshot["conf"]["ftp_guest_user"]
+        stale = {
+            user["username"]
+            for user in users
+            if _path_state(snapshot["files"].get(user["username"]))
+            != self._user_config_state(guest, self._render_user_config(user))
+        }
+        return self._provision(
             task_vars,
-            args["webroot"],
-            conf_vars["ftp_guest_user"],
-            conf_vars["ftp_guest_user"],
-            "0755",
+            result,
+            mode="apply",
+            users=[
+                dict(
+                    username=user["username"],
+                    webroot=user["webroot"],
+                    password_hash=credentials.get(user["username"]),
+                    skeleton=user["skeleton"],
+                    user_config=(
+                        self._render_user_config(user)
+                        if user["username"] in stale
+                        else None
+                    ),
+                )
+                for user in users
+            ],
+            remove=removals,
+            absent_mode=self._task.args.get("absent_mode", "delete"),
+            userdb=self._task.args.get("userdb"),
+            userdb_pam_service=self._task.args.get("userdb_pam_service"),
         )
 
-        if exec_result.get("failed"):
-            result.update(exec_result)
-            raise AnsibleActionFail(
-                message=result.get("msg"),
-                orig_exc=result.get("exception"),
-                result=result,
+    def _plan_changes(self, users, removals, snapshot, credentials):
+        """Work out per-user changes and a compact diff from the snapshot.
+
+        ``credentials`` is the result of ``_hash_pending_credentials``, or
+        None in check mode, where passwords of active rows are assumed
+        unchanged rather than verified.
+        """
+        guest = snapshot["conf"]["ftp_guest_user"]
+        absent_mode = self._task.args.get("absent_mode", "delete")
+        planned = dict(users={}, removed={}, diff=[])
+
+        for user in users:
+            name = user["username"]
+            row = snapshot["rows"].get(name)
+            content = self._render_user_config(user)
+            repairs = snapshot.get("repairs", {}).get(user["webroot"], 0)
+            missing = snapshot.get("skeleton_missing", {}).get(user["webroot"], [])
+            before = dict(
+                row=_row_state(row),
+                webroot=_path_state(snapshot["webroots"].get(user["webroot"]))
+                + (f", {repairs} entries to repair" if repairs else "")
+                + (f", missing {', '.join(missing)}" if missing else ""),
+                user_config=_path_state(snapshot["files"].get(name)),
             )
-
-        return exec_result.get("changed", False)
-
-    def _create_vsftpd_user_config_file(self, args, conf_vars, task_vars, result):
-        """Create the user-specific vsftpd configuration file."""
-        config_content = f"local_root={args['webroot']}\nwrite_enable=YES\n"
-        uname = _safe_identifier(args["username"])
-
-        copy_task = self._task.copy()
-        copy_task.args = dict(
-            dest=f"{conf_vars['ftp_users_dir']}/{uname}",
-            content=config_content,
-            owner=conf_vars["ftp_guest_user"],
-            group=conf_vars["ftp_guest_user"],
-            mode="0644",
-        )
-        copy_task.no_log = True  # extra safety
-
-        exec_result = self._shared_loader_obj.action_loader.get(
-            "ansible.builtin.copy",
-            task=copy_task,
-            connection=self._connection,
-            play_context=self._play_context,
-            loader=self._loader,
-            templar=self._templar,
-            shared_loader_obj=self._shared_loader_obj,
-        ).run(task_vars=task_vars)
-
-        if exec_result.get("failed"):
-            result.update(exec_result)
-            raise AnsibleActionFail(
-                message=result.get("msg"),
-                orig_exc=result.get("exception"),
-                result=result,
+            after = dict(
+                row="active",
+                webroot=_path_state(dict(owner=guest, group=guest, mode="0755")),
+                user_config=self._user_config_state(guest, content),
+            )
+            if credentials is not None and name in credentials and row:
+                after["row"] = "active, password updated"
+            changes = {key: before[key] != after[key] for key in before}
+            planned["users"][name] = dict(
+                database=changes["row"],
+                webroot=changes["webroot"],
+                user_config=changes["user_config"],
+            )
+            if any(changes.values()):
+                before = {k: v for k, v in before.items() if changes[k]}
+                after = {k: v for k, v in after.items() if changes[k]}
+                if "user_config" in after:
+                    after["user_config"] = content
+                planned["diff"].append(
+                    dict(
+                        before_header=f"ftp user {name}",
+                        after_header=f"ftp user {name}",
+                        before=before,
+                        after=after,
+                    )
+                )
+
+        for name in removals:
+            row = snapshot["rows"].get(name)
+            if name in snapshot.get("accounts", {}):
+                row = dict(active=snapshot["accounts"][name])
+            has_file = (
+                snapshot["files"].get(name) is not None
+                or name in snapshot.get("config_files", ())
             )
+            if absent_mode == "delete":
+                db_change = row is not None
+            else:
+                db_change = bool(row and row["active"])
+            planned["removed"][name] = dict(database=db_change, user_config=has_file)
+            if db_change or has_file:
+                planned["diff"].append(
+                    dict(
+                        before_header=f"ftp user {name}",
+                        after_header=f"ftp user {name} ({absent_mode})",
+                        before=dict(
+                            row=_row_state(row),
+                            user_config="present" if has_file else "absent",
+                        ),
+                        after=dict(
+                            row="absent" if absent_mode == "delete" else "inactive",
+                            user_config="absent",
+                        ),
+                    )
+                )
+        return planned
+
+    @staticmethod
+    def _user_config_state(guest, content):
+        """``_path_state`` of a per-user vsftpd file holding ``content``."""
+        return _path_state(
+            dict(
+                owner=guest,
+                group=guest,
+                mode="0644",
+                checksum=hashlib.sha1(content.encode()).hexdigest(),
+            )
+        )
 
-        return exec_result.get("changed", False)
+    @staticmethod
+    def _render_user_config(user):
+        """Content of the user-specific vsftpd configuration file."""
+        return f"local_root={user['webroot']}\nwrite_enable=YES\n"
 
 
 class ConfigVarMissingError(AnsibleActionFail):
@@ -307,7 +686,11 @@ class ConfigVarMissingError(AnsibleActionFail):
             "for FTP logins. Without it, the plugin cannot locate and parse the associated "
             "PAM configuration to extract database login credentials."
         ),
-        "db_login_user": ("No 'user=<username>' found in PAM configuration. "),
+        "db_login_user": (
+            "No 'user=<username>' found in PAM configuration. "
+            "If pam_service_name names a pam_userdb service, set db_pam_service "
+            "to the pam_mysql one. "
+        ),
         "db_login_password": ("No 'passwd=<password>' found in PAM configuration. "),
         "db_name": ("No 'db=<name>' found in PAM configuration. "),
         "db_host": ("No 'host=<hostname|IP>' found in PAM configuration. "),
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+End-to-end performance harness for the ftp action plugin.
+
+Starts a throwaway MariaDB/MySQL server on a unix socket in a temporary
+datadir, writes a vsftpd.conf and a pam_mysql service file pointing at it,
+and runs the plugin against localhost (connection=local) for every batch
+size. Each size gets a fresh users table (files/mysql-virtual-users.sql)
+and two runs of the same task: "create" provisions every account,
+"converge" repeats it and should change nothing. Each run is its own
+ansible-playbook invocation.
+
+Usage:
+    python3 ftp_perf_harness.py                       # 1, 100, 10000 users
+    python3 ftp_perf_harness.py --users 500 -o out.json
+    python3 ftp_perf_harness.py --mysqld /usr/sbin/mariadbd --keep
+
+Needs ansible-playbook, PyMySQL and a mariadbd/mysqld binary; nothing
+outside the temporary directory is touched, webroots included. The JSON
+report has, per size and run, the plugin's wall time, ms per user, remote
+module executions, DB statements and per-phase seconds. db_statements is
+the plugin's own count; server_queries is the server's Questions counter
+over the run, which also sees connection setup and COMMIT.
+"""
+
+import argparse
+import getpass
+import json
+import os
+import platform
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pymysql
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(HERE)
+ROLE_DIR = os.path.dirname(PLUGIN_DIR)
+SCHEMA_SQL = os.path.join(ROLE_DIR, "files", "mysql-virtual-users.sql")
+
+DEFAULT_SIZES = [1, 100, 10000]
+RUNS = ("create", "converge")
+
+# mysqld and the install scripts usually live outside a user's PATH.
+SERVER_PATH = os.pathsep.join(
+    [os.environ.get("PATH", ""), "/usr/sbin", "/usr/libexec", "/usr/local/sbin"]
+)
+
+DB_NAME = "ftp"
+DB_USER = "ftp"
+
+
+class Server:
+    """A private mysqld listening only on a unix socket below ``base``."""
+
+    def __init__(self, base, mysqld, install_db=None):
+        self.base = base
+        self.mysqld = mysqld
+        self.install_db = install_db
+        self.datadir = os.path.join(base, "data")
+        self.socket = os.path.join(base, "mysql.sock")
+        self.log = os.path.join(base, "mysqld.log")
+        # mysqld refuses to run as root unless told to.
+        self.user_args = ["--user=root"] if os.geteuid() == 0 else []
+        self.proc = None
+
+    def start(self, timeout):
+        if self.install_db:
+            init = [
+                self.install_db,
+                "--no-defaults",
+                f"--datadir={self.datadir}",
+                "--auth-root-authentication-method=normal",
+            ]
+        else:
+            init = [
+                self.mysqld,
+                "--no-defaults",
+                "--initialize-insecure",
+                f"--datadir={self.datadir}",
+            ]
+        subprocess.run(
+            init + self.user_args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        self.proc = subprocess.Popen(
+            [
+                self.mysqld,
+                "--no-defaults",
+                f"--datadir={self.datadir}",
+                f"--socket={self.socket}",
+                f"--pid-file={os.path.join(self.base, 'mysqld.pid')}",
+                f"--log-error={self.log}",
+                "--skip-networking",
+                *self.user_args,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.connect().close()
+                return
+            except pymysql.Error:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"mysqld did not come up, see {self.log}")
+                time.sleep(0.2)
+
+    def connect(self, **kwargs):
+        return pymysql.connect(unix_socket=self.socket, user="root", **kwargs)
+
+    def stop(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+def find_server(opts):
+    """Return ``(mysqld, install_db)``; install_db is None for MySQL."""
+    mysqld = opts.mysqld or shutil.which("mariadbd", path=SERVER_PATH)
+    mysqld = mysqld or shutil.which("mysqld", path=SERVER_PATH)
+    if not mysqld:
+        sys.exit("No mariadbd or mysqld found, pass --mysqld")
+    version = subprocess.run(
+        [mysqld, "--version"], capture_output=True, text=True
+    ).stdout
+    install_db = None
+    if "mariadb" in version.lower():
+        install_db = shutil.which(
+            "mariadb-install-db", path=SERVER_PATH
+        ) or shutil.which("mysql_install_db", path=SERVER_PATH)
+        if not install_db:
+            sys.exit("MariaDB needs mariadb-install-db to create the datadir")
+    return mysqld, install_db
+
+
+def create_database(server, password):
+    conn = server.connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE DATABASE {DB_NAME}")
+            cur.execute(
+                f"CREATE USER '{DB_USER}'@'localhost' IDENTIFIED BY %s", (password,)
+            )
+            cur.execute(f"GRANT ALL ON {DB_NAME}.* TO '{DB_USER}'@'localhost'")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def reset_users_table(server):
+    with open(SCHEMA_SQL, encoding="utf-8") as f:
+        ddl = f.read().strip().rstrip(";")
+    conn = server.connect(database=DB_NAME)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS users")
+            cur.execute(ddl)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def write_host_config(base, socket, password):
+    """The vsftpd.conf and PAM service the module reads, as ``(conf, pam_dir)``."""
+    pam_dir = os.path.join(base, "pam.d")
+    users_dir = os.path.join(base, "vsftpd_users")
+    os.makedirs(pam_dir)
+    os.makedirs(users_dir)
+    vsftpd_conf = os.path.join(base, "vsftpd.conf")
+    with open(vsftpd_conf, "w", encoding="utf-8") as f:
+        f.write(
+            "pam_service_name=vsftpd.mysql\n"
+            f"guest_username={getpass.getuser()}\n"
+            f"user_config_dir={users_dir}\n"
+        )
+    with open(os.path.join(pam_dir, "vsftpd.mysql"), "w", encoding="utf-8") as f:
+        for kind in ("auth", "account"):
+            f.write(
+                f"{kind} required pam_mysql.so user={DB_USER} passwd={password} "
+                f"host={socket} db={DB_NAME} table=users usercolumn=username "
+                "passwdcolumn=password crypt=1\n"
+            )
+    return vsftpd_conf, pam_dir
+
+
+def write_users(base, size):
+    """Write the ``size`` accounts to a vars file and return its path."""
+    users = [
+        dict(
+            username=f"perf{i:05d}",
+            password=f"pw-{i}",
+            webroot=os.path.join(base, "www", f"perf{i:05d}"),
+        )
+        for i in range(size)
+    ]
+    vars_file = os.path.join(base, f"users-{size}.json")
+    with open(vars_file, "w", encoding="utf-8") as f:
+        json.dump(dict(ftp_users=users), f)
+    return vars_file
+
+
+def write_playbook(base, name, vars_file, vsftpd_conf, pam_dir):
+    """A play running the ftp task once and dumping its ``perf`` result."""
+    task = dict(
+        state="present",
+        users="{{ ftp_users }}",
+        vsftpd_conf=vsftpd_conf,
+        pam_dir=pam_dir,
+    )
+    play = dict(
+        hosts="localhost",
+        connection="local",
+        gather_facts=False,
+        vars=dict(ansible_python_interpreter=sys.executable),
+        vars_files=[vars_file],
+        tasks=[
+            dict(ftp=task, register="provisioned"),
+            dict(
+                copy=dict(
+                    content="{{ {'changed': provisioned.changed, "
+                    "'perf': provisioned.perf} | to_json }}",
+                    dest=os.path.join(base, f"perf-{name}.json"),
+                )
+            ),
+        ],
+    )
+    # JSON is valid YAML, so ansible-playbook reads it as is.
+    playbook = os.path.join(base, f"playbook-{name}.json")
+    with open(playbook, "w", encoding="utf-8") as f:
+        json.dump([play], f, indent=1)
+    return playbook
+
+
+def server_queries(server):
+    """The server's Questions counter (statements sent by clients)."""
+    conn = server.connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+            return int(cur.fetchone()[1])
+    finally:
+        conn.close()
+
+
+def run_playbook(base, playbook):
+    env = dict(
+        os.environ,
+        ANSIBLE_ACTION_PLUGINS=PLUGIN_DIR,
+        ANSIBLE_LIBRARY=os.path.join(ROLE_DIR, "library"),
+        ANSIBLE_LOCALHOST_WARNING="False",
+        ANSIBLE_INVENTORY_UNPARSED_WARNING="False",
+        ANSIBLE_RETRY_FILES_ENABLED="False",
+        # The plugin imports its helpers from util/ as top-level modules.
+        PYTHONPATH=os.pathsep.join(
+            filter(
+                None, [os.path.join(PLUGIN_DIR, "util"), os.environ.get("PYTHONPATH")]
+            )
+        ),
+    )
+    started = time.monotonic()
+    res = subprocess.run(
+        ["ansible-playbook", "-i", "localhost,", playbook],
+        cwd=base,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if res.returncode:
+        sys.stderr.write(res.stdout[-4000:] + res.stderr[-4000:])
+        sys.exit(f"ansible-playbook failed for {playbook}")
+    return time.monotonic() - started
+
+
+def summarize(size, result, queries):
+    perf = result["perf"]
+    seconds = perf["total_seconds"]
+    return dict(
+        users=size,
+        changed=result["changed"],
+        seconds=round(seconds, 4),
+        ms_per_user=round(1000 * seconds / size, 3),
+        module_runs=perf["module_runs"],
+        db_statements=perf["db_statements"],
+        server_queries=queries,
+        phases={
+            name: round(phase["seconds"], 4) for name, phase in perf["phases"].items()
+        },
+        hashing={
+            k: v
+            for k, v in perf["phases"].get("sha512_crypt", {}).items()
+            if k != "seconds"
+        },
+        remote=perf["remote"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", help="write the JSON report here")
+    parser.add_argument(
+        "--users", type=int, action="append", help="batch size (repeatable)"
+    )
+    parser.add_argument("--mysqld", help="server binary (default: mariadbd/mysqld)")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the temporary directory"
+    )
+    opts = parser.parse_args()
+    sizes = opts.users or DEFAULT_SIZES
+
+    mysqld, install_db = find_server(opts)
+    base = tempfile.mkdtemp(prefix="ftp-perf-")
+    server = Server(base, mysqld, install_db)
+    report = dict(
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        mysqld=mysqld,
+        sizes=[],
+    )
+    try:
+        server.start(opts.startup_timeout)
+        password = secrets.token_hex(16)
+        create_database(server, password)
+        vsftpd_conf, pam_dir = write_host_config(base, server.socket, password)
+        for size in sizes:
+            reset_users_table(server)
+            shutil.rmtree(os.path.join(base, "www"), ignore_errors=True)
+            for name in os.listdir(os.path.join(base, "vsftpd_users")):
+                os.unlink(os.path.join(base, "vsftpd_users", name))
+            vars_file = write_users(base, size)
+            entry = dict(users=size)
+            for run in RUNS:
+                name = f"{size}-{run}"
+                playbook = write_playbook(base, name, vars_file, vsftpd_conf, pam_dir)
+                before = server_queries(server)
+                wall = run_playbook(base, playbook)
+                # Minus the SHOW STATUS that took the first reading.
+                queries = server_queries(server) - before - 1
+                with open(
+                    os.path.join(base, f"perf-{name}.json"), encoding="utf-8"
+                ) as f:
+                    r = summarize(size, json.load(f), queries)
+                r["playbook_seconds"] = round(wall, 3)
+                entry[run] = r
+                print(
+                    f"{size:>6} users {run:<9} {r['seconds']:>9.3f}s "
+                    f"{r['ms_per_user']:>9.3f} ms/user {r['module_runs']:>3} modules "
+                    f"{r['db_statements']:>5} statements "
+                    f"{r['server_queries']:>5} server queries",
+                    file=sys.stderr,
+                )
+            report["sizes"].append(entry)
+    finally:
+        server.stop()
+        if opts.keep:
+            print(f"kept {base}", file=sys.stderr)
+        else:
+            shutil.rmtree(base, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if opts.output:
+        with open(opts.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Known-answer, differential and benchmark suite for util/sha512crypt.py.
+
+Usage:
+    python3 sha512crypt_bench.py                  # full run, JSON on stdout
+    python3 sha512crypt_bench.py --quick -o out.json
+    python3 sha512crypt_bench.py --rounds 5000 --rounds 50000 --iterations 20
+
+Exits non-zero if any correctness check fails, so it can gate a release.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import time
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "util"))
+import sha512crypt  # noqa: E402
+
+# From https://www.akkadia.org/drepper/SHA-crypt.txt
+DREPPER_VECTORS = [
+    (
+        "$6$saltstring",
+        "Hello world!",
+        "$6$saltstring$svn8UoSVapNtMuq1ukKS4tPQd8iKwSMHWjl/O817G3uBnIFNjnQJuesI68u4OTLiBFdcbYEdFCoEOfaS35inz1",
+    ),
+    (
+        "$6$rounds=10000$saltstringsaltstring",
+        "Hello world!",
+        "$6$rounds=10000$saltstringsaltst$OW1/O6BYHV6BcXZu8QVeXbDWra3Oeqh0sbHbbMCVNSnCM/UrjmM0Dp8vOuZeHBy/YTBmSK6H9qs/y3RnOaw5v.",
+    ),
+    (
+        "$6$rounds=5000$toolongsaltstring",
+        "This is just a test",
+        "$6$rounds=5000$toolongsaltstrin$lQ8jolhgVRVhY4b5pZKaysCLi0QBxGoNeKQzQ3glMhwllF7oGDZxUhx1yxdYcz/e1JSbq3y6JMxxl8audkUEm0",
+    ),
+    (
+        "$6$rounds=1400$anotherlongsaltstring",
+        "a very much longer text to encrypt.  This one even stretches over morethan one line.",
+        "$6$rounds=1400$anotherlongsalts$POfYwTEok97VWcjxIiSOjiykti.o/pQs.wPvMxQ6Fm7I6IoYN3CmLs66x9t0oSwbtEW7o7UmJEiDwGqd8p4ur1",
+    ),
+    (
+        "$6$rounds=77777$short",
+        "we have a short salt string but not a short password",
+        "$6$rounds=77777$short$WuQyW2YR.hBNpjjRhpYD/ifIw05xdfeEyQoMxIXbkvr0gge1a1x3yRULJ5CCaUeOxFmtlcGZelFl5CxtgfiAc0",
+    ),
+    (
+        "$6$rounds=123456$asaltof16chars..",
+        "a short string",
+        "$6$rounds=123456$asaltof16chars..$BtCwjqMJGx5hrJhZywWvt0RLE8uZ4oPwcelCjmw2kSYu.Ec6ycULevoBK25fs2xXgMNrCzIMVcgEJAstJeonj1",
+    ),
+    (
+        "$6$rounds=10$roundstoolow",
+        "the minimum number is still observed",
+        "$6$rounds=1000$roundstoolow$kUMsbe306n21p9R.FRkW3IGn.S9NPN0x50YhH1xhLsPuWGsUSklZt58jaTfF4ZEQpyUNGc0dqbpBYYBaHHrsX.",
+    ),
+]
+
+
+def reference_sha512_crypt(password: str, setting: str) -> str:
+    """Straight transcription of the spec, one bytes concatenation per round.
+
+    Kept deliberately unoptimised: it is the baseline for the benchmark and
+    an independent oracle for the differential checks.
+    """
+    salt, rounds, rounds_custom = sha512crypt.parse_salt(setting)
+    pw, sl = password.encode(), salt.encode()
+
+    b = hashlib.sha512(pw + sl + pw).digest()
+    a = pw + sl + (b * (len(pw) // 64)) + b[: len(pw) % 64]
+    i = len(pw)
+    while i:
+        a += b if i & 1 else pw
+        i >>= 1
+    a = hashlib.sha512(a).digest()
+
+    dp = hashlib.sha512(pw * len(pw)).digest()
+    p = (dp * (len(pw) // 64)) + dp[: len(pw) % 64]
+    ds = hashlib.sha512(sl * (16 + a[0])).digest()
+    s = (ds * (len(sl) // 64)) + ds[: len(sl) % 64]
+
+    c = a
+    for r in range(rounds):
+        buf = p if r & 1 else c
+        if r % 3:
+            buf += s
+        if r % 7:
+            buf += p
+        buf += c if r & 1 else p
+        c = hashlib.sha512(buf).digest()
+
+    encoded = "".join(
+        sha512crypt.b64_from_24bit(c[x], c[y], c[z], 4)
+        for x, y, z in sha512crypt._FINAL_PERMUTATION
+    ) + sha512crypt.b64_from_24bit(0, 0, c[63], 2)
+    return f"{sha512crypt._setting(salt, rounds, rounds_custom)}${encoded}"
+
+
+def backends() -> dict:
+    impls = {
+        "reference": reference_sha512_crypt,
+        "python": sha512crypt.sha512_crypt_python,
+    }
+    if sha512crypt.BACKEND == "native":
+        impls["native"] = sha512crypt.sha512_crypt
+    return impls
+
+
+def openssl_crypt():
+    if not shutil.which("openssl"):
+        return None
+
+    def run(password, setting):
+        salt = setting.removeprefix(sha512crypt.PREFIX)
+        res = subprocess.run(
+            ["openssl", "passwd", "-6", "-salt", salt, "-stdin"],
+            input=password + "\n",
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return res.stdout.strip()
+
+    return run
+
+
+def system_crypt():
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            import crypt
+    except ImportError:
+        return None
+    return crypt.crypt
+
+
+def check_known_answers(impls: dict, quick: bool) -> list:
+    failures = []
+    for name, fn in impls.items():
+        for setting, password, expected in DREPPER_VECTORS:
+            rounds = sha512crypt.parse_salt(setting)[1]
+            if rounds > 10000 and (quick or name == "reference"):
+                continue
+            got = fn(password, setting)
+            if got != expected:
+                failures.append(
+                    dict(check="known_answer", backend=name, setting=setting, got=got)
+                )
+    return failures
+
+
+def random_cases(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + string.punctuation + " äß€"
+    cases = []
+    for _ in range(count):
+        # Cover the 64-byte block boundaries for both password and salt.
+        pw_len = rng.choice([0, 1, 63, 64, 65, 127, 128, 129, rng.randint(0, 200)])
+        password = "".join(rng.choice(alphabet) for _ in range(pw_len))
+        salt = "".join(
+            rng.choice(sha512crypt.CRYPT_B64) for _ in range(rng.randint(1, 20))
+        )
+        rounds = rng.choice([None, 1000, 1001, 5000, 5041])
+        setting = sha512crypt.PREFIX
+        if rounds:
+            setting += f"{sha512crypt.ROUNDS_PREFIX}{rounds}$"
+        cases.append((password, setting + salt))
+    return cases
+
+
+def check_differential(impls: dict, cases: list) -> tuple:
+    oracles = {"reference": reference_sha512_crypt}
+    for name, factory in (("openssl", openssl_crypt), ("crypt", system_crypt)):
+        fn = factory()
+        if fn:
+            oracles[name] = fn
+
+    failures = []
+    for password, setting in cases:
+        expected = reference_sha512_crypt(password, setting)
+        for name, fn in list(oracles.items()) + list(impls.items()):
+            if name == "reference":
+                continue
+            # openssl -stdin reads one line and prints nothing for an empty one.
+            if name == "openssl" and (not password or "\n" in password):
+                continue
+            got = fn(password, setting)
+            if got != expected:
+                failures.append(
+                    dict(check="differential", backend=name, setting=setting, got=got)
+                )
+        if not sha512crypt.verify(password, expected):
+            failures.append(dict(check="verify", setting=setting))
+    return sorted(oracles), failures
+
+
+def benchmark(impls: dict, rounds_list: list, iterations: int) -> list:
+    results = []
+    for rounds in rounds_list:
+        for name, fn in impls.items():
+            n = max(1, iterations // 4) if name == "reference" else iterations
+            setting = f"{sha512crypt.PREFIX}{sha512crypt.ROUNDS_PREFIX}{rounds}$benchsalt"
+            fn("warm-up", setting)
+            samples = []
+            for i in range(n):
+                start = time.perf_counter()
+                fn(f"password{i}", setting)
+                samples.append(time.perf_counter() - start)
+            samples.sort()
+            results.append(
+                dict(
+                    backend=name,
+                    rounds=rounds,
+                    iterations=n,
+                    min_s=samples[0],
+                    median_s=samples[len(samples) // 2],
+                    mean_s=sum(samples) / n,
+                    hashes_per_s=n / sum(samples),
+                )
+            )
+
+    batch = [f"password{i}" for i in range(iterations * 4)]
+    start = time.perf_counter()
+    sha512crypt.hash_many(batch)
+    elapsed = time.perf_counter() - start
+    results.append(
+        dict(
+            backend=f"hash_many[{sha512crypt.BACKEND}]",
+            rounds=sha512crypt.ROUNDS_DEFAULT,
+            iterations=len(batch),
+            total_s=elapsed,
+            hashes_per_s=len(batch) / elapsed,
+        )
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", help="write the JSON report here")
+    parser.add_argument("--rounds", type=int, action="append")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--cases", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=6)
+    parser.add_argument(
+        "--quick", action="store_true", help="skip slow vectors, fewer cases"
+    )
+    opts = parser.parse_args()
+
+    impls = backends()
+    cases = random_cases(20 if opts.quick else opts.cases, opts.seed)
+    failures = check_known_answers(impls, opts.quick)
+    oracles, diff_failures = check_differential(impls, cases)
+    failures += diff_failures
+
+    report = dict(
+        python=platform.python_version(),
+        machine=platform.machine(),
+        cpu_count=os.cpu_count(),
+        active_backend=sha512crypt.BACKEND,
+        oracles=oracles,
+        cases=len(cases),
+        failures=failures,
+        benchmarks=benchmark(
+            impls,
+            opts.rounds or [sha512crypt.ROUNDS_DEFAULT],
+            2 if opts.quick else opts.iterations,
+        ),
+    )
+
+    text = json.dumps(report, indent=2)
+    if opts.output:
+        with open(opts.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
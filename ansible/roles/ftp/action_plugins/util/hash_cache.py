@@ -0,0 +1,155 @@
+# Controller-side cache of SHA-512 crypt hashes, encrypted with Ansible Vault.
+# Lets repeat runs reuse the $6$ hash (and salt) made for a password instead
+# of computing a new one, and skip verifying rows that still hold it.
+#
+# Entries are keyed by HMAC(host, username) and remember HMAC(host, username,
+# password) next to the hash, so the file never holds a password and a
+# rotated password is detected as a mismatch, which drops the entry. The
+# HMAC key and the AES key both come from the first vault secret; the file
+# is vault encrypted JSON, oldest entry first:
+#
+#   {"version": 1, "entries": [[ident, fingerprint, "$6$..."], ...]}
+#
+# Several forks may share one file: the lock is held for the initial read
+# and for the read-merge-write in save(), never while hashing.
+import fcntl
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ansible.errors import AnsibleError
+from ansible.parsing.vault import match_encrypt_secret
+
+FORMAT_VERSION = 1
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class HashCache:
+    """LRU map of ``(host, username, password)`` to a crypt hash."""
+
+    def __init__(self, path, vault, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.vault = vault
+        self.max_entries = max_entries
+        self.vault_id, self.secret = match_encrypt_secret(vault.secrets)
+        self._key = hmac.new(
+            self.secret.bytes, b"ftp-hash-cache", hashlib.sha256
+        ).digest()
+        # ident -> entry to store (refreshing its recency), or None to drop.
+        self._updates = {}
+        self.stats = dict(hits=0, misses=0, rotated=0, evicted=0, reset=False)
+        with self._locked():
+            self.entries = self._read()
+
+    def _mac(self, *parts) -> str:
+        message = json.dumps(parts).encode()
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()
+
+    def get(self, host: str, username: str, password: str):
+        """The cached hash of ``password``, or None.
+
+        A cached entry for another password means it was rotated; the entry
+        is dropped.
+        """
+        ident = self._mac(host, username)
+        entry = self.entries.get(ident)
+        if entry is not None and not hmac.compare_digest(
+            entry[0], self._mac(host, username, password)
+        ):
+            self.invalidate(host, username)
+            self.stats["rotated"] += 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(ident)
+        self._updates[ident] = entry
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, host: str, username: str, password: str, hashed: str) -> None:
+        ident = self._mac(host, username)
+        entry = [self._mac(host, username, password), hashed]
+        self.entries[ident] = entry
+        self.entries.move_to_end(ident)
+        self._updates[ident] = entry
+
+    def invalidate(self, host: str, username: str) -> None:
+        ident = self._mac(host, username)
+        self.entries.pop(ident, None)
+        self._updates[ident] = None
+
+    def save(self) -> None:
+        """Merge this run's changes into the file and trim it to size."""
+        if not self._updates:
+            return
+        with self._locked():
+            # Another fork may have saved since we read the file.
+            entries = self._read()
+            for ident, entry in self._updates.items():
+                if entry is None:
+                    entries.pop(ident, None)
+                else:
+                    entries[ident] = entry
+                    entries.move_to_end(ident)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.stats["evicted"] += 1
+            self._write(entries)
+        self.entries = entries
+        self._updates.clear()
+
+    @contextmanager
+    def _locked(self):
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> OrderedDict:
+        try:
+            with open(self.path, "rb") as f:
+                data = json.loads(self.vault.decrypt(f.read()))
+        except FileNotFoundError:
+            return OrderedDict()
+        except (AnsibleError, ValueError):
+            # Unreadable with the current vault secret (rotated) or damaged:
+            # start over, every entry is only a shortcut.
+            self.stats["reset"] = True
+            return OrderedDict()
+        if not isinstance(data, dict) or data.get("version") != FORMAT_VERSION:
+            self.stats["reset"] = True
+            return OrderedDict()
+        return OrderedDict(
+            (ident, [fingerprint, hashed])
+            for ident, fingerprint, hashed in data["entries"]
+        )
+
+    def _write(self, entries) -> None:
+        plaintext = json.dumps(
+            dict(
+                version=FORMAT_VERSION,
+                entries=[[ident, *entry] for ident, entry in entries.items()],
+            ),
+            separators=(",", ":"),
+        )
+        vaulttext = self.vault.encrypt(
+            plaintext, secret=self.secret, vault_id=self.vault_id
+        )
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, prefix=f".{os.path.basename(self.path)}-"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(vaulttext)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
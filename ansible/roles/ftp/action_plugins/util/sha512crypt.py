@@ -1,15 +1,61 @@
 # SHA-512 Crypt Implementation in Python
-# Only default 5000 rounds supported
+# Supports the default 5000 rounds and custom "$6$rounds=N$" hashes.
 # This implementation is compatible with the SHA-512 crypt algorithm used in Unix-like systems.
 # It generates a hashed password using a given salt and number of rounds.
 # From https://www.akkadia.org/drepper/SHA-crypt.txt (PUBLIC DOMAIN)
+# When libcrypt/libxcrypt is available and passes a known-answer self-test,
+# hashing is delegated to crypt_rn/crypt_r through ctypes instead.
 import hashlib
 import base64
+import ctypes as ct
+import ctypes.util
+import hmac
+import os
 import secrets
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # Custom base64 alphabet used by crypt(3)
 CRYPT_B64 = "./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
 
+PREFIX = "$6$"
+ROUNDS_PREFIX = "rounds="
+ROUNDS_DEFAULT = 5000
+ROUNDS_MIN = 1000
+ROUNDS_MAX = 999999999
+SALT_LEN_MAX = 16
+
+# Byte triples of the final digest, in crypt(3) output order.
+_FINAL_PERMUTATION = [
+    (0, 21, 42), (22, 43, 1), (44, 2, 23), (3, 24, 45), (25, 46, 4),
+    (47, 5, 26), (6, 27, 48), (28, 49, 7), (50, 8, 29), (9, 30, 51),
+    (31, 52, 10), (53, 11, 32), (12, 33, 54), (34, 55, 13), (56, 14, 35),
+    (15, 36, 57), (37, 58, 16), (59, 17, 38), (18, 39, 60), (40, 61, 19),
+    (62, 20, 41),
+]  # fmt: skip
+
+# The round layout only depends on cnt % 2, cnt % 3 and cnt % 7.
+_CYCLE = 42
+
+# Below this many items a process pool costs more than it saves.
+PARALLEL_MIN_BATCH = 8
+
+# Large enough for both glibc (~128 KiB) and libxcrypt (32 KiB) crypt_data.
+CRYPT_DATA_SIZE = 256 * 1024
+
+# Drepper's reference vectors, used for the native backend self-test.
+KNOWN_ANSWERS = [
+    (
+        "Hello world!",
+        "$6$saltstring",
+        "$6$saltstring$svn8UoSVapNtMuq1ukKS4tPQd8iKwSMHWjl/O817G3uBnIFNjnQJuesI68u4OTLiBFdcbYEdFCoEOfaS35inz1",
+    ),
+    (
+        "Hello world!",
+        "$6$rounds=10000$saltstringsaltstring",
+        "$6$rounds=10000$saltstringsaltst$OW1/O6BYHV6BcXZu8QVeXbDWra3Oeqh0sbHbbMCVNSnCM/UrjmM0Dp8vOuZeHBy/YTBmSK6H9qs/y3RnOaw5v.",
+    ),
+]
+
 
 def b64_from_24bit(b2, b1, b0, n):
     v = (b2 << 16) | (b1 << 8) | b0
@@ -22,7 +68,41 @@ def generate_salt(length=16):
     return b64[:length]
 
 
-def sha512_crypt(password: str, salt: str, rounds: int = 5000) -> str:
+def parse_salt(salt: str, rounds: int = None):
+    """Split a crypt(3) salt setting into ``(salt, rounds, rounds_custom)``.
+
+    Accepts a bare salt, ``rounds=N$salt`` or a full ``$6$...`` hash, the
+    same way glibc does: the salt stops at the next ``$`` and is truncated
+    to 16 characters, rounds are clamped to the allowed range.
+    """
+    salt = salt.removeprefix(PREFIX)
+    custom = False
+    if salt.startswith(ROUNDS_PREFIX):
+        num, sep, rest = salt[len(ROUNDS_PREFIX) :].partition("$")
+        if sep and num.isdigit():
+            rounds, custom, salt = int(num), True, rest
+    if rounds is None:
+        rounds = ROUNDS_DEFAULT
+    elif rounds != ROUNDS_DEFAULT:
+        custom = True
+    rounds = max(ROUNDS_MIN, min(rounds, ROUNDS_MAX))
+    return salt.split("$", 1)[0][:SALT_LEN_MAX], rounds, custom
+
+
+def sha512_crypt(password: str, salt: str, rounds: int = None) -> str:
+    """Hash ``password`` with the active backend (see ``BACKEND``)."""
+    if _native_crypt is not None:
+        salt, rounds, rounds_custom = parse_salt(salt, rounds)
+        setting = _setting(salt, rounds, rounds_custom)
+        hashed = _native_crypt(password.encode(), setting.encode())
+        if hashed is not None:
+            return hashed
+    return sha512_crypt_python(password, salt, rounds)
+
+
+def sha512_crypt_python(password: str, salt: str, rounds: int = None) -> str:
+    """Pure-Python SHA-512 crypt, used when no native backend is available."""
+    salt, rounds, rounds_custom = parse_salt(salt, rounds)
     pw = password.encode()
     sl = salt.encode()
     pw_len = len(pw)
@@ -101,71 +181,171 @@ def sha512_crypt(password: str, salt: str, rounds: int = 5000) -> str:
             sha512_process_bytes (p_sequence, key_len, &ctx);
         sha512_finish_ctx (&ctx, alt_result);
     }
+
+    alt_result is either the first or the last input of every round, so
+    the rest of the round is one of only eight constant byte strings. Odd
+    rounds start from a pre-fed hashlib context that is copied, even rounds
+    hash alt_result followed by a precomputed tail.
     """
-    for i in range(rounds):
-        ctx = b""
-        if i & 1:
-            ctx += P_bytes
+    schedule = _round_schedule(P_bytes, S_bytes)
+    sha512 = hashlib.sha512
+    full_cycles, remainder = divmod(rounds, _CYCLE)
+    for _ in range(full_cycles):
+        for odd, data in schedule:
+            if odd:
+                h = data.copy()
+                h.update(alt_result)
+            else:
+                h = sha512(alt_result)
+                h.update(data)
+            alt_result = h.digest()
+    for odd, data in schedule[:remainder]:
+        if odd:
+            h = data.copy()
+            h.update(alt_result)
         else:
-            ctx += alt_result
-        if i % 3:
-            ctx += S_bytes
-        if i % 7:
-            ctx += P_bytes
-        if i & 1:
-            ctx += alt_result
-        else:
-            ctx += P_bytes
-        alt_result = hashlib.sha512(ctx).digest()
+            h = sha512(alt_result)
+            h.update(data)
+        alt_result = h.digest()
 
     """
     Reorder bytes into the final result string per the crypt(3) base64
     mapping table.
     """
-    rearranged = (
-        b64_from_24bit(alt_result[0], alt_result[21], alt_result[42], 4)
-        + b64_from_24bit(alt_result[22], alt_result[43], alt_result[1], 4)
-        + b64_from_24bit(alt_result[44], alt_result[2], alt_result[23], 4)
-        + b64_from_24bit(alt_result[3], alt_result[24], alt_result[45], 4)
-        + b64_from_24bit(alt_result[25], alt_result[46], alt_result[4], 4)
-        + b64_from_24bit(alt_result[47], alt_result[5], alt_result[26], 4)
-        + b64_from_24bit(alt_result[6], alt_result[27], alt_result[48], 4)
-        + b64_from_24bit(alt_result[28], alt_result[49], alt_result[7], 4)
-        + b64_from_24bit(alt_result[50], alt_result[8], alt_result[29], 4)
-        + b64_from_24bit(alt_result[9], alt_result[30], alt_result[51], 4)
-        + b64_from_24bit(alt_result[31], alt_result[52], alt_result[10], 4)
-        + b64_from_24bit(alt_result[53], alt_result[11], alt_result[32], 4)
-        + b64_from_24bit(alt_result[12], alt_result[33], alt_result[54], 4)
-        + b64_from_24bit(alt_result[34], alt_result[55], alt_result[13], 4)
-        + b64_from_24bit(alt_result[56], alt_result[14], alt_result[35], 4)
-        + b64_from_24bit(alt_result[15], alt_result[36], alt_result[57], 4)
-        + b64_from_24bit(alt_result[37], alt_result[58], alt_result[16], 4)
-        + b64_from_24bit(alt_result[59], alt_result[17], alt_result[38], 4)
-        + b64_from_24bit(alt_result[18], alt_result[39], alt_result[60], 4)
-        + b64_from_24bit(alt_result[40], alt_result[61], alt_result[19], 4)
-        + b64_from_24bit(alt_result[62], alt_result[20], alt_result[41], 4)
-        + b64_from_24bit(0, 0, alt_result[63], 2)
-    )
-
-    return f"$6${salt}${rearranged}"
-
-
-""" if __name__ == "__main__":
-    import subprocess
-    salt = generate_salt()
-    password = "mypassword"
-
-    py_hash = sha512_crypt(password, salt)
-    print(f"Salt: {salt}, Password: {password}")
-    print(f"Python:  {py_hash}")
-
-    result = subprocess.run(
-        ["openssl", "passwd", "-6", "-salt", salt, password],
-        capture_output=True,
-        text=True,
-        check=True
-    )
-    openssl_hash = result.stdout.strip()
-    print(f"OpenSSL: {openssl_hash}")
-    print("Match:", py_hash == openssl_hash)
-"""
+    rearranged = "".join(
+        b64_from_24bit(alt_result[a], alt_result[b], alt_result[c], 4)
+        for a, b, c in _FINAL_PERMUTATION
+    ) + b64_from_24bit(0, 0, alt_result[63], 2)
+
+    return f"{_setting(salt, rounds, rounds_custom)}${rearranged}"
+
+
+def _setting(salt: str, rounds: int, rounds_custom: bool) -> str:
+    if rounds_custom:
+        return f"{PREFIX}{ROUNDS_PREFIX}{rounds}${salt}"
+    return f"{PREFIX}{salt}"
+
+
+def _load_native_crypt():
+    """Return a ``crypt(phrase, setting) -> str | None`` callable, or None.
+
+    Prefers libxcrypt's ``crypt_rn`` and falls back to ``crypt_r``. The
+    backend is only used if it reproduces ``KNOWN_ANSWERS`` exactly.
+    """
+    libcrypt_path = ctypes.util.find_library("crypt")
+    if not libcrypt_path:
+        return None
+    try:
+        libcrypt = ct.CDLL(libcrypt_path)
+    except OSError:
+        return None
+
+    if hasattr(libcrypt, "crypt_rn"):
+        crypt_rn = libcrypt.crypt_rn
+        crypt_rn.argtypes = [ct.c_char_p, ct.c_char_p, ct.c_void_p, ct.c_int]
+        crypt_rn.restype = ct.c_char_p
+
+        def call(phrase, setting, data):
+            return crypt_rn(phrase, setting, data, CRYPT_DATA_SIZE)
+
+    elif hasattr(libcrypt, "crypt_r"):
+        crypt_r = libcrypt.crypt_r
+        crypt_r.argtypes = [ct.c_char_p, ct.c_char_p, ct.c_void_p]
+        crypt_r.restype = ct.c_char_p
+
+        def call(phrase, setting, data):
+            return crypt_r(phrase, setting, data)
+
+    else:
+        return None
+
+    def native_crypt(phrase: bytes, setting: bytes):
+        # C strings stop at NUL; leave such passwords to the Python code.
+        if b"\0" in phrase:
+            return None
+        data = ct.create_string_buffer(CRYPT_DATA_SIZE)
+        out = call(phrase, setting, data)
+        if not out or not out.startswith(PREFIX.encode()):
+            return None
+        return out.decode("ascii")
+
+    try:
+        for password, setting, expected in KNOWN_ANSWERS:
+            if native_crypt(password.encode(), setting.encode()) != expected:
+                return None
+    except (OSError, ct.ArgumentError):
+        return None
+    return native_crypt
+
+
+_native_crypt = _load_native_crypt()
+
+# Name of the active hashing backend: "native" (libcrypt) or "python".
+BACKEND = "native" if _native_crypt is not None else "python"
+
+
+def _round_schedule(P_bytes: bytes, S_bytes: bytes) -> list:
+    """Build the 42-round cycle of ``(odd, prefix_ctx | tail_bytes)`` entries."""
+    prefixes = {}
+    tails = {}
+    schedule = []
+    for cnt in range(_CYCLE):
+        key = (cnt % 3 != 0, cnt % 7 != 0)
+        middle = (S_bytes if key[0] else b"") + (P_bytes if key[1] else b"")
+        if cnt & 1:
+            if key not in prefixes:
+                prefixes[key] = hashlib.sha512(P_bytes + middle)
+            schedule.append((True, prefixes[key]))
+        else:
+            if key not in tails:
+                tails[key] = middle + P_bytes
+            schedule.append((False, tails[key]))
+    return schedule
+
+
+def verify(password: str, hashed: str) -> bool:
+    """Check a password against a stored ``$6$[rounds=N$]salt$hash`` string."""
+    if not hashed or not hashed.startswith(PREFIX) or hashed.count("$") < 3:
+        return False
+    return hmac.compare_digest(sha512_crypt(password, hashed), hashed)
+
+
+def _hash_one(item):
+    password, salt, rounds = item
+    return sha512_crypt(password, salt, rounds)
+
+
+def _verify_one(item):
+    password, hashed = item
+    return verify(password, hashed)
+
+
+def _map(fn, items: list, max_workers: int = None) -> list:
+    """Run ``fn`` over ``items``, on a process pool when the batch is big enough."""
+    workers = min(max_workers or os.cpu_count() or 1, len(items))
+    if workers < 2 or len(items) < PARALLEL_MIN_BATCH:
+        return [fn(item) for item in items]
+    if BACKEND == "native":
+        # ctypes drops the GIL during the C call, so threads are enough.
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fn, items))
+    # A few chunks per worker keeps IPC low and still balances the load.
+    chunksize = max(1, len(items) // (workers * 4))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fn, items, chunksize=chunksize))
+    except (OSError, NotImplementedError):
+        # No usable multiprocessing (e.g. no /dev/shm); do it in-process.
+        return [fn(item) for item in items]
+
+
+def hash_many(passwords, rounds: int = None, max_workers: int = None) -> list:
+    """Hash every password with a fresh salt, spreading the work across cores."""
+    items = [(pw, generate_salt(SALT_LEN_MAX), rounds) for pw in passwords]
+    return _map(_hash_one, items, max_workers)
+
+
+def verify_many(pairs, max_workers: int = None) -> list:
+    """Verify ``(password, hashed)`` pairs, spreading the work across cores."""
+    return _map(_verify_one, list(pairs), max_workers)
+
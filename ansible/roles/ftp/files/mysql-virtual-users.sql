@@ -1,5 +1,8 @@
 CREATE TABLE IF NOT EXISTS users (
   id INT AUTO_INCREMENT PRIMARY KEY,
-  username VARCHAR(50) NOT NULL,
-  password VARCHAR(48) NOT NULL
-);
\ No newline at end of file
+  username VARCHAR(64) NOT NULL,
+  password VARCHAR(255) NOT NULL,
+  active TINYINT(1) NOT NULL DEFAULT 1,
+  UNIQUE KEY users_username (username),
+  KEY users_login (username, active, password)
+);
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Turn vsftpd logs into Zabbix trapper data.
+
+Reads what was appended to the wu-ftpd style xferlog (transfers) and to
+vsftpd_log_file (logins, written with log_ftp_protocol/dual_log_enable)
+since the previous run, and prints zabbix_sender input:
+
+    vsftpd.users.discovery / vsftpd.clients.discovery   low-level discovery
+    vsftpd.bytes[in|out]  vsftpd.files[in|out]  vsftpd.throughput[in|out]
+    vsftpd.logins[ok|fail]  vsftpd.logins.rate
+    vsftpd.user.bytes[<user>,in|out]  vsftpd.user.files[<user>,in|out]
+    vsftpd.user.throughput[<user>]  vsftpd.user.logins[<user>,ok|fail]
+    vsftpd.client.bytes[<ip>]  vsftpd.client.logins[<ip>,ok|fail]
+    vsftpd.users.other.bytes[in|out]  vsftpd.users.other.files[in|out]
+    vsftpd.users.other.logins[ok|fail]  vsftpd.clients.other.bytes
+    vsftpd.clients.other.logins[ok|fail]      sums of evicted entries
+
+Counters are per run (the delta since the last offset), throughput is bytes
+per second of transfer time. Offsets are kept per file together with its
+inode, so a rotated log is finished before the new one is read, and a
+truncated one is read again from the start. Per-user and per-client tables
+are capped (--max-keys): once full, the smallest entry is evicted and its
+sums move to the "other" keys. The newcomer starts from zero and only
+inherits the evicted weight for ranking (space-saving), which keeps the
+heavy hitters in the table in constant memory.
+
+Usage:
+    vsftpd_xferstats.py                               # print sender input
+    vsftpd_xferstats.py --send -c /etc/zabbix/zabbix_agentd.conf
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+# xferlog: 5 date fields, transfer-time, remote-host, file-size, filename
+# (may contain spaces), then these 9 fields.
+XFERLOG_TAIL = 9
+
+LOGIN_PAT = re.compile(
+    r'\[(?P<user>[^\]]+)\] (?P<status>OK|FAIL) LOGIN: Client "(?P<client>[^"]+)"'
+)
+
+
+class Counter:
+    """Per-key sums with at most ``max_keys`` keys (space-saving eviction).
+
+    ``weight`` only ranks the keys: a newcomer that evicts the lightest key
+    inherits its weight, as the bound on what it may have had before, but
+    none of its sums, which are added to ``other`` instead.
+    """
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.items = {}
+        self.other = {}
+
+    def add(self, key, weight, **fields):
+        entry = self.items.get(key)
+        if entry is None:
+            entry = {"weight": 0}
+            if len(self.items) >= self.max_keys:
+                victim = min(self.items, key=lambda k: self.items[k]["weight"])
+                evicted = self.items.pop(victim)
+                entry["weight"] = evicted.pop("weight")
+                for name, value in evicted.items():
+                    self.other[name] = self.other.get(name, 0) + value
+            self.items[key] = entry
+        entry["weight"] += weight
+        for name, value in fields.items():
+            entry[name] = entry.get(name, 0) + value
+
+
+class Stats:
+    def __init__(self, max_keys):
+        self.totals = {}
+        self.users = Counter(max_keys)
+        self.clients = Counter(max_keys)
+
+    def _total(self, name, value):
+        self.totals[name] = self.totals.get(name, 0) + value
+
+    def transfer(self, line):
+        fields = line.split()
+        if len(fields) < 8 + XFERLOG_TAIL:
+            return
+        try:
+            seconds = max(int(fields[5]), 1)
+            size = int(fields[7])
+        except ValueError:
+            return
+        client = fields[6]
+        direction, user = fields[-7], fields[-5]
+        if direction not in ("i", "o"):
+            return
+        way = "in" if direction == "i" else "out"
+        self._total(f"bytes_{way}", size)
+        self._total(f"files_{way}", 1)
+        self._total(f"seconds_{way}", seconds)
+        self.users.add(
+            user, size, **{f"bytes_{way}": size, f"files_{way}": 1, "seconds": seconds}
+        )
+        self.clients.add(client, size, bytes=size)
+
+    def login(self, line):
+        m = LOGIN_PAT.search(line)
+        if not m:
+            return
+        status = "ok" if m["status"] == "OK" else "fail"
+        self._total(f"logins_{status}", 1)
+        self.users.add(m["user"], 0, **{f"logins_{status}": 1})
+        self.clients.add(m["client"], 0, **{f"logins_{status}": 1})
+
+
+def _rotated_sibling(path, inode):
+    """The rotated copy of ``path`` that still has ``inode``, if any."""
+    for candidate in sorted(glob.glob(glob.escape(path) + "?*")):
+        if candidate.endswith((".gz", ".bz2", ".xz", ".zst")):
+            continue
+        try:
+            if os.stat(candidate).st_ino == inode:
+                return candidate
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _read_from(path, offset, handle):
+    """Feed complete lines after ``offset`` to ``handle``; return new offset."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            offset += len(raw)
+            handle(raw.decode("utf-8", errors="replace"))
+    return offset
+
+
+def follow(path, state, handle):
+    """Process what was appended to ``path`` since ``state`` recorded it."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return
+    saved = state.get(path, {})
+    offset = saved.get("offset", 0)
+    if saved and saved.get("inode") != st.st_ino:
+        rotated = _rotated_sibling(path, saved["inode"])
+        if rotated:
+            _read_from(rotated, offset, handle)
+        offset = 0
+    elif st.st_size < offset:
+        offset = 0  # truncated in place (copytruncate)
+    state[path] = dict(inode=st.st_ino, offset=_read_from(path, offset, handle))
+
+
+def _key(name, *params):
+    quoted = [
+        '"' + p.replace('"', '\\"') + '"' if re.search(r'[,\]"\s]', p) else p
+        for p in map(str, params)
+    ]
+    return f"{name}[{','.join(quoted)}]" if params else name
+
+
+def _value(v):
+    if isinstance(v, (dict, list)):
+        text = json.dumps(v, separators=(",", ":"))
+    else:
+        text = str(v)
+    if re.search(r'["\s\\]', text):
+        return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return text
+
+
+def sender_lines(stats, host, elapsed):
+    t, lines = stats.totals, []
+
+    def emit(key, value):
+        lines.append(f"{host} {key} {_value(value)}")
+
+    emit(
+        "vsftpd.users.discovery",
+        {"data": [{"{#FTPUSER}": u} for u in sorted(stats.users.items)]},
+    )
+    emit(
+        "vsftpd.clients.discovery",
+        {"data": [{"{#FTPCLIENT}": c} for c in sorted(stats.clients.items)]},
+    )
+    for way in ("in", "out"):
+        emit(_key("vsftpd.bytes", way), t.get(f"bytes_{way}", 0))
+        emit(_key("vsftpd.files", way), t.get(f"files_{way}", 0))
+        seconds = t.get(f"seconds_{way}", 0)
+        emit(
+            _key("vsftpd.throughput", way),
+            round(t.get(f"bytes_{way}", 0) / seconds, 1) if seconds else 0,
+        )
+    logins = t.get("logins_ok", 0) + t.get("logins_fail", 0)
+    emit(_key("vsftpd.logins", "ok"), t.get("logins_ok", 0))
+    emit(_key("vsftpd.logins", "fail"), t.get("logins_fail", 0))
+    emit("vsftpd.logins.rate", round(logins / elapsed, 3) if elapsed else 0)
+
+    for user, e in sorted(stats.users.items.items()):
+        for way in ("in", "out"):
+            emit(_key("vsftpd.user.bytes", user, way), e.get(f"bytes_{way}", 0))
+            emit(_key("vsftpd.user.files", user, way), e.get(f"files_{way}", 0))
+        moved = e.get("bytes_in", 0) + e.get("bytes_out", 0)
+        emit(
+            _key("vsftpd.user.throughput", user),
+            round(moved / e["seconds"], 1) if e.get("seconds") else 0,
+        )
+        emit(_key("vsftpd.user.logins", user, "ok"), e.get("logins_ok", 0))
+        emit(_key("vsftpd.user.logins", user, "fail"), e.get("logins_fail", 0))
+    for client, e in sorted(stats.clients.items.items()):
+        emit(_key("vsftpd.client.bytes", client), e.get("bytes", 0))
+        emit(_key("vsftpd.client.logins", client, "ok"), e.get("logins_ok", 0))
+        emit(_key("vsftpd.client.logins", client, "fail"), e.get("logins_fail", 0))
+
+    users, clients = stats.users.other, stats.clients.other
+    for way in ("in", "out"):
+        emit(_key("vsftpd.users.other.bytes", way), users.get(f"bytes_{way}", 0))
+        emit(_key("vsftpd.users.other.files", way), users.get(f"files_{way}", 0))
+    emit("vsftpd.clients.other.bytes", clients.get("bytes", 0))
+    for status in ("ok", "fail"):
+        emit(
+            _key("vsftpd.users.other.logins", status),
+            users.get(f"logins_{status}", 0),
+        )
+        emit(
+            _key("vsftpd.clients.other.logins", status),
+            clients.get(f"logins_{status}", 0),
+        )
+    return lines
+
+
+def load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--xferlog", default="/var/log/xferlog")
+    parser.add_argument("--vsftpd-log", default="/var/log/vsftpd.log")
+    parser.add_argument("--state", default="/var/lib/vsftpd-xferstats.json")
+    parser.add_argument("--max-keys", type=int, default=1000)
+    parser.add_argument(
+        "--host", default="-", help="Zabbix host name, '-' takes it from -c"
+    )
+    parser.add_argument(
+        "--send", action="store_true", help="pipe into zabbix_sender instead of stdout"
+    )
+    parser.add_argument("-c", "--config", default="/etc/zabbix/zabbix_agentd.conf")
+    opts = parser.parse_args()
+
+    state = load_state(opts.state)
+    logs = state.setdefault("logs", {})
+    now = time.time()
+    elapsed = now - state["last_run"] if "last_run" in state else 0
+
+    stats = Stats(opts.max_keys)
+    follow(opts.xferlog, logs, stats.transfer)
+    if opts.vsftpd_log != opts.xferlog:
+        follow(opts.vsftpd_log, logs, stats.login)
+    lines = sender_lines(stats, opts.host, elapsed)
+
+    if opts.send:
+        res = subprocess.run(
+            ["zabbix_sender", "-c", opts.config, "-i", "-"],
+            input="\n".join(lines) + "\n",
+            text=True,
+        )
+        # 2 means some values were rejected (items not created yet); the
+        # offsets still advance so the same lines are not counted twice.
+        if res.returncode not in (0, 2):
+            sys.exit(res.returncode)
+    else:
+        print("\n".join(lines))
+
+    state["last_run"] = now
+    save_state(opts.state, state)
+
+
+if __name__ == "__main__":
+    main()
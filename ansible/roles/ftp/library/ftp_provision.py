@@ -0,0 +1,944 @@
+#!/usr/bin/python
+"""
+Remote half of the `ftp` action plugin.
+
+Does all host-side work of a provisioning task in one module execution:
+
+    mode=snapshot  read and parse vsftpd.conf + the PAM service file, with
+                   schema=verify|migrate check (and fix) the users table, then
+                   select the stored rows of the requested users and stat
+                   their webroots and vsftpd files (read-only, safe under
+                   check mode); with inventory=true also list every account
+                   and every file in user_config_dir; with webroot_repair
+                   under check mode also count the entries apply would fix;
+                   with skeletons list the skeleton files each webroot lacks
+    mode=apply     upsert the given password hashes, ensure the webroots,
+                   write the per-user vsftpd files the controller sent
+                   (only those that differ) and delete or deactivate
+                   the accounts in remove (rows and vsftpd files); seeds
+                   missing skeleton files into each webroot and, with
+                   webroot_repair, fixes the entries below it that are not
+                   owned by or not accessible to the guest user; with
+                   userdb compiles the active accounts into a pam_userdb
+                   Berkeley DB file and, with userdb_pam_service, writes
+                   a PAM service using it
+
+The database credentials are read from the PAM file on the host and never
+returned to the controller. schema=migrate needs ALTER and INDEX (CREATE for
+a missing table) on the FTP database for that account. Once pam_service_name
+names a pam_userdb service, db_pam_service has to name the pam_mysql one
+the credentials are read from. vsftpd.conf itself belongs to the role's
+"Deploy vsftpd.conf" task and is never edited here: vsftpd is switched to
+the userdb service by setting ftp_pam_service_name in the role.
+"""
+
+import errno
+import grp
+import hashlib
+import os
+import pwd
+import re
+import stat
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils._text import to_bytes, to_text
+
+try:
+    import pymysql
+except ImportError:
+    pymysql = None
+    PYMYSQL_IMPORT_ERROR = traceback.format_exc()
+else:
+    PYMYSQL_IMPORT_ERROR = None
+
+
+VAR_PATTERNS = {
+    "ftp_guest_user": re.compile(
+        r"^\s*(?:guest_username|ftp_username|chown_username)\s*=\s*(\S+)",
+        re.MULTILINE,
+    ),
+    "ftp_users_dir": re.compile(r"^\s*user_config_dir\s*=\s*(\S+)", re.MULTILINE),
+    "pam_service_name": re.compile(
+        r"^\s*pam_service_name\s*=\s*(\S+)", re.MULTILINE
+    ),
+}
+
+PAM_PATTERNS = {
+    "db_login_user": re.compile(r"\buser=([^\s]+)"),
+    "db_login_password": re.compile(r"\bpasswd=([^\s]+)"),
+    "db_name": re.compile(r"\bdb=([^\s]+)"),
+    "db_host": re.compile(r"\bhost=([^\s]+)"),
+}
+
+# Values that stay on the host.
+PRIVATE_CONF_KEYS = ("db_login_user", "db_login_password")
+
+# Usernames per SELECT ... IN (...); bounds the placeholder count per statement.
+DB_CHUNK_SIZE = 500
+
+# Shape of the users table: pam_mysql looks rows up by username and active,
+# and a $6$rounds=...$ hash needs up to 123 characters. Keep in sync with
+# files/mysql-virtual-users.sql.
+USERS_TABLE_DDL = (
+    "CREATE TABLE IF NOT EXISTS users ("
+    "id INT AUTO_INCREMENT PRIMARY KEY, "
+    "username VARCHAR(64) NOT NULL, "
+    "password VARCHAR(255) NOT NULL, "
+    "active TINYINT(1) NOT NULL DEFAULT 1, "
+    "UNIQUE KEY users_username (username), "
+    "KEY users_login (username, active, password))"
+)
+
+# column: (minimum VARCHAR length or None, definition)
+SCHEMA_COLUMNS = {
+    "username": (64, "VARCHAR(64) NOT NULL"),
+    "password": (255, "VARCHAR(255) NOT NULL"),
+    "active": (None, "TINYINT(1) NOT NULL DEFAULT 1"),
+}
+
+# index: (unique, columns). Existing indexes count by their columns, not
+# by their name: any unique index on exactly (username) will do, and any
+# index starting with the pam lookup columns covers it.
+SCHEMA_INDEXES = {
+    "users_username": (True, ["username"]),
+    "users_login": (False, ["username", "active", "password"]),
+}
+
+# Without these the module's own statements fail.
+SCHEMA_BLOCKING = ("create table users", "add column active")
+
+# db_load is versioned on some distributions.
+USERDB_LOADERS = ("db_load", "db5.3_load", "db4.8_load")
+
+
+class Timings(dict):
+    """Monotonic seconds spent per step, returned as ``timings``."""
+
+    @contextmanager
+    def step(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self[name] = self.get(name, 0.0) + time.monotonic() - start
+
+
+class ConfigVarMissing(Exception):
+    def __init__(self, key, source):
+        super().__init__(key)
+        self.key = key
+        self.source = source
+
+
+def _read_text(path):
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", errors="replace")
+
+
+def _parse_vars(text, patterns, source):
+    out = {}
+    for key, pat in patterns.items():
+        m = pat.search(text)
+        if not m:
+            raise ConfigVarMissing(key, source)
+        out[key] = m.group(1)
+    return out
+
+
+def gather_configuration_vars(vsftpd_conf, pam_dir, db_pam_service=None):
+    conf_vars = _parse_vars(_read_text(vsftpd_conf), VAR_PATTERNS, vsftpd_conf)
+    pam_path = os.path.join(pam_dir, db_pam_service or conf_vars["pam_service_name"])
+    conf_vars.update(_parse_vars(_read_text(pam_path), PAM_PATTERNS, pam_path))
+    return conf_vars
+
+
+def server_address(host):
+    """pymysql connect arguments for a pam_mysql ``host=`` value.
+
+    Like pam_mysql it accepts an absolute unix socket path, a host name or
+    ``host:port``.
+    """
+    if host.startswith("/"):
+        return dict(unix_socket=host)
+    name, sep, port = host.rpartition(":")
+    if sep and port.isdigit() and ":" not in name:
+        return dict(host=name, port=int(port))
+    return dict(host=host)
+
+
+class Database:
+    """One connection for the whole module run, parameterized statements only.
+
+    ``statements`` counts round trips to the server for reporting.
+    """
+
+    def __init__(self, conf_vars):
+        self.conf_vars = conf_vars
+        self.conn = None
+        self.statements = 0
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = pymysql.connect(
+                **server_address(self.conf_vars["db_host"]),
+                user=self.conf_vars["db_login_user"],
+                password=self.conf_vars["db_login_password"],
+                database=self.conf_vars["db_name"],
+                charset="utf8mb4",
+                autocommit=False,
+            )
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def select_users(self, usernames):
+        """Return ``{username: {password, active}}`` for the given users."""
+        rows = {}
+        with self.connect().cursor() as cur:
+            for i in range(0, len(usernames), DB_CHUNK_SIZE):
+                chunk = usernames[i : i + DB_CHUNK_SIZE]
+                cur.execute(
+                    "SELECT username, password, active FROM users "
+                    f"WHERE username IN ({','.join(['%s'] * len(chunk))})",
+                    chunk,
+                )
+                self.statements += 1
+                for username, password, active in cur.fetchall():
+                    rows[to_text(username)] = dict(
+                        password=to_text(password), active=int(active)
+                    )
+        return rows
+
+    def list_accounts(self):
+        """Return ``{username: active}`` for every row of the users table."""
+        with self.connect().cursor() as cur:
+            cur.execute("SELECT username, active FROM users")
+            self.statements += 1
+            return {to_text(u): int(a) for u, a in cur.fetchall()}
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connect()
+        try:
+            yield
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def schema_changes(self):
+        """Return ``[(description, clause)]`` still missing from the users table.
+
+        ``clause`` is an ALTER TABLE specification, or None when the table
+        itself is missing.
+        """
+        with self.connect().cursor() as cur:
+            cur.execute(
+                "SELECT COLUMN_NAME, CHARACTER_MAXIMUM_LENGTH "
+                "FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users'"
+            )
+            self.statements += 1
+            columns = {to_text(name).lower(): size for name, size in cur.fetchall()}
+            if not columns:
+                return [("create table users", None)]
+
+            cur.execute(
+                "SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME "
+                "FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users' "
+                "ORDER BY INDEX_NAME, SEQ_IN_INDEX"
+            )
+            self.statements += 1
+            indexes = {}
+            for name, non_unique, column in cur.fetchall():
+                unique, cols = indexes.setdefault(
+                    to_text(name), (not int(non_unique), [])
+                )
+                cols.append(to_text(column).lower())
+
+        changes = []
+        for column, (length, definition) in SCHEMA_COLUMNS.items():
+            if column not in columns:
+                changes.append(
+                    (f"add column {column}", f"ADD COLUMN {column} {definition}")
+                )
+            elif length and (columns[column] or 0) < length:
+                changes.append(
+                    (
+                        f"widen {column} from {columns[column]} to {length}",
+                        f"MODIFY COLUMN {column} {definition}",
+                    )
+                )
+        for name, (unique, cols) in SCHEMA_INDEXES.items():
+            if unique:
+                found = (u and c == cols for u, c in indexes.values())
+            else:
+                found = (c[: len(cols)] == cols for u, c in indexes.values())
+            if not any(found):
+                kind = "UNIQUE KEY" if unique else "KEY"
+                changes.append(
+                    (
+                        f"add index {name} ({', '.join(cols)})",
+                        f"ADD {kind} {name} ({', '.join(cols)})",
+                    )
+                )
+        return changes
+
+    def duplicate_usernames(self, limit=10):
+        with self.connect().cursor() as cur:
+            cur.execute(
+                "SELECT username FROM users GROUP BY username "
+                "HAVING COUNT(*) > 1 LIMIT %s",
+                (limit,),
+            )
+            self.statements += 1
+            return [to_text(u) for (u,) in cur.fetchall()]
+
+    def migrate_schema(self, changes):
+        """Apply ``schema_changes()`` in one DDL statement."""
+        clauses = [clause for _, clause in changes]
+        with self.connect().cursor() as cur:
+            if None in clauses:
+                cur.execute(USERS_TABLE_DDL)
+            else:
+                cur.execute(f"ALTER TABLE users {', '.join(clauses)}")
+            self.statements += 1
+
+    def active_credentials(self):
+        """Return ``[(username, hash)]`` of every active account, sorted."""
+        with self.connect().cursor() as cur:
+            cur.execute(
+                "SELECT username, password FROM users WHERE active = 1 "
+                "ORDER BY username"
+            )
+            self.statements += 1
+            return [(to_text(u), to_text(p)) for u, p in cur.fetchall()]
+
+    def upsert_users(self, credentials):
+        """Write ``[(username, hash)]`` as active rows.
+
+        One multi-row INSERT ... ON DUPLICATE KEY UPDATE per DB_CHUNK_SIZE
+        users, built here rather than left to ``executemany``, which only
+        folds rows whose VALUES group is all placeholders.
+        """
+        with self.connect().cursor() as cur:
+            for i in range(0, len(credentials), DB_CHUNK_SIZE):
+                chunk = credentials[i : i + DB_CHUNK_SIZE]
+                cur.execute(
+                    "INSERT INTO users (username, password, active) VALUES "
+                    + ",".join(["(%s, %s, 1)"] * len(chunk))
+                    + " ON DUPLICATE KEY UPDATE password=VALUES(password), active=1",
+                    [value for row in chunk for value in row],
+                )
+                self.statements += 1
+
+    def remove_users(self, usernames, absent_mode):
+        """Delete or deactivate ``usernames``; return the ones that changed."""
+        changed = set()
+        with self.connect().cursor() as cur:
+            for i in range(0, len(usernames), DB_CHUNK_SIZE):
+                chunk = usernames[i : i + DB_CHUNK_SIZE]
+                placeholders = ",".join(["%s"] * len(chunk))
+                condition = "" if absent_mode == "delete" else " AND active <> 0"
+                cur.execute(
+                    "SELECT username FROM users "
+                    f"WHERE username IN ({placeholders}){condition}",
+                    chunk,
+                )
+                found = [to_text(u) for (u,) in cur.fetchall()]
+                self.statements += 1
+                if not found:
+                    continue
+                placeholders = ",".join(["%s"] * len(found))
+                if absent_mode == "delete":
+                    sql = f"DELETE FROM users WHERE username IN ({placeholders})"
+                else:
+                    sql = (
+                        "UPDATE users SET active = 0 "
+                        f"WHERE username IN ({placeholders})"
+                    )
+                cur.execute(sql, found)
+                self.statements += 1
+                changed.update(found)
+        return changed
+
+
+def local_path(path):
+    """Expand ``~`` and ``$VARS`` in ``path`` like a ``type="path"`` option.
+
+    Webroots are taken as ``type="str"`` instead, so the results are keyed by
+    the strings the plugin sent and looks them up by.
+    """
+    return os.path.expanduser(os.path.expandvars(path))
+
+
+def ensure_directory(module, path, owner, mode):
+    changed = False
+    if not os.path.isdir(path):
+        os.makedirs(path, mode=mode)
+        changed = True
+    changed = module.set_owner_if_different(path, owner, changed)
+    changed = module.set_group_if_different(path, owner, changed)
+    changed = module.set_mode_if_different(path, mode, changed)
+    return changed
+
+
+def guest_ids(module, guest):
+    try:
+        return pwd.getpwnam(guest).pw_uid, grp.getgrnam(guest).gr_gid
+    except KeyError:
+        module.fail_json(msg=f"Guest user or group '{guest}' does not exist")
+
+
+def repair_tree(root, uid, gid, dry_run=False):
+    """Give the guest user everything below ``root``; return entries fixed.
+
+    Only writes to entries whose owner or group is not the guest, or that
+    lack owner read/write (and search on directories). Other permission
+    bits are kept, so a converged tree costs one lstat per entry and no
+    writes.
+
+    The guest can write to the tree while this runs as root, so no path
+    below ``root`` is ever resolved: os.fwalk opens every directory
+    relative to its parent's fd and skips one that was swapped for a
+    symlink, directories are fixed through their own fd, regular files
+    through an O_NOFOLLOW fd checked against the lstat, and anything else
+    by name relative to the parent fd without following symlinks. Files
+    with more than one link are left alone, they may be hard links to a
+    file outside the webroot.
+    """
+    try:
+        if not stat.S_ISDIR(os.lstat(root).st_mode):
+            return 0
+    except FileNotFoundError:
+        return 0
+    fixed = 0
+    for dirpath, dirnames, filenames, dir_fd in os.fwalk(root):
+        if dirpath != root:
+            fixed += _repair_fd(dir_fd, os.fstat(dir_fd), 0o700, uid, gid, dry_run)
+        # Symlinks to directories are listed in dirnames but never entered.
+        for name in dirnames + filenames:
+            try:
+                st = os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                continue  # fixed through its own fd when fwalk enters it
+            if not stat.S_ISREG(st.st_mode):
+                if st.st_uid != uid or st.st_gid != gid:
+                    fixed += 1
+                    if not dry_run:
+                        os.chown(name, uid, gid, dir_fd=dir_fd, follow_symlinks=False)
+                continue
+            if st.st_nlink > 1 or not _needs_repair(st, 0o600, uid, gid):
+                continue
+            if dry_run:
+                fixed += 1
+                continue
+            try:
+                fd = os.open(
+                    name, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK, dir_fd=dir_fd
+                )
+            except OSError as ex:
+                if ex.errno in (errno.ENOENT, errno.ELOOP):
+                    continue  # removed or swapped for a symlink meanwhile
+                raise
+            try:
+                fst = os.fstat(fd)
+                if os.path.samestat(st, fst) and fst.st_nlink == 1:
+                    fixed += _repair_fd(fd, fst, 0o600, uid, gid, dry_run)
+            finally:
+                os.close(fd)
+    return fixed
+
+
+def _needs_repair(st, need, uid, gid):
+    return st.st_uid != uid or st.st_gid != gid or st.st_mode & need != need
+
+
+def _repair_fd(fd, st, need, uid, gid, dry_run):
+    """Fix owner and mode of the open file ``fd``; return 1 if it needed it."""
+    if not _needs_repair(st, need, uid, gid):
+        return 0
+    if not dry_run:
+        if st.st_uid != uid or st.st_gid != gid:
+            os.fchown(fd, uid, gid)
+        if st.st_mode & need != need:
+            os.fchmod(fd, stat.S_IMODE(st.st_mode) | need)
+    return 1
+
+
+def seed_skeleton(root, skeleton, uid, gid):
+    """Create the missing ``skeleton`` files in ``root``; return how many.
+
+    Existing files are never touched, they belong to the customer. Owner
+    and mode are set on the new file's fd, never through its path.
+    """
+    seeded = 0
+    for name, content in skeleton.items():
+        path = os.path.join(root, name)
+        try:
+            fd = os.open(
+                path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o644
+            )
+        except FileExistsError:
+            continue
+        with os.fdopen(fd, "wb") as f:
+            os.fchown(fd, uid, gid)
+            os.fchmod(fd, 0o644)
+            f.write(to_bytes(content))
+        seeded += 1
+    return seeded
+
+
+def export_userdb(module, path, credentials):
+    """Compile ``credentials`` into ``<path>.db`` for pam_userdb crypt=crypt.
+
+    The file is rebuilt only when the account set differs from the last
+    export, whose digest is kept in a dotfile next to it, and is replaced
+    by a rename so logins never see a half-written database.
+    """
+    db_path = path + ".db"
+    directory, name = os.path.split(db_path)
+    digest_path = os.path.join(directory, f".{name}.sha256")
+    # pam_userdb input is one line per key and value.
+    credentials = [
+        (u, p) for u, p in credentials if "\n" not in u and "\n" not in p
+    ]
+    digest = hashlib.sha256()
+    for username, hashed in credentials:
+        digest.update(f"{username}\0{hashed}\n".encode())
+    digest = digest.hexdigest()
+    out = dict(changed=False, path=db_path, accounts=len(credentials))
+    try:
+        with open(digest_path) as f:
+            exported = f.read().strip()
+    except FileNotFoundError:
+        exported = None
+    if exported == digest and os.path.exists(db_path):
+        return out
+
+    loader = next(filter(None, map(module.get_bin_path, USERDB_LOADERS)), None)
+    if loader is None:
+        module.fail_json(msg="db_load not found, install db4-utils or libdb-utils")
+    fd, source = tempfile.mkstemp(dir=directory, prefix=".ftp-userdb-")
+    target = source + ".db"
+    try:
+        with os.fdopen(fd, "w") as f:
+            for username, hashed in credentials:
+                f.write(f"{username}\n{hashed}\n")
+        module.run_command(
+            [loader, "-T", "-t", "hash", "-f", source, target], check_rc=True
+        )
+        os.chmod(target, 0o600)
+        os.replace(target, db_path)
+    finally:
+        for tmp_path in (source, target):
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    with open(digest_path, "w") as f:
+        f.write(digest + "\n")
+    out["changed"] = True
+    return out
+
+
+def write_userdb_service(module, service, userdb):
+    """Write a pam_userdb PAM ``service``; return True if it changed."""
+    pam_path = os.path.join(module.params["pam_dir"], service)
+    line = f"pam_userdb.so db={userdb} crypt=crypt"
+    return write_file(
+        module,
+        pam_path,
+        f"auth    required {line}\naccount required {line}\n",
+        "root",
+        0o644,
+    )
+
+
+def write_file(module, path, content, owner, mode):
+    """Atomically replace ``path`` if its content differs, then fix metadata."""
+    data = to_bytes(content)
+    changed = False
+    try:
+        with open(path, "rb") as f:
+            current = f.read()
+    except FileNotFoundError:
+        current = None
+
+    if current != data:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".ftp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            module.atomic_move(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        changed = True
+
+    changed = module.set_owner_if_different(path, owner, changed)
+    changed = module.set_group_if_different(path, owner, changed)
+    changed = module.set_mode_if_different(path, mode, changed)
+    return changed
+
+
+def remove_file(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def config_manifest(users_dir, names, inventory):
+    """Owner, group, mode and sha1 of the per-user vsftpd files.
+
+    One pass over ``user_config_dir``: ``names`` are checksummed, other
+    files are only listed (as None) when ``inventory`` is set.
+    """
+    wanted = set(names)
+    manifest = {}
+    try:
+        with os.scandir(users_dir) as it:
+            for e in it:
+                if e.name.startswith(".") or not e.is_file():
+                    continue
+                if e.name in wanted:
+                    manifest[e.name] = stat_path(e.path, checksum=True)
+                elif inventory:
+                    manifest[e.name] = None
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def _owner_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+def _group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+def stat_path(path, checksum=False):
+    """Owner, group and mode of ``path`` (plus content sha1), or None."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    out = dict(
+        owner=_owner_name(st.st_uid),
+        group=_group_name(st.st_gid),
+        mode="%04o" % (st.st_mode & 0o7777),
+    )
+    if checksum:
+        with open(path, "rb") as f:
+            out["checksum"] = hashlib.sha1(f.read()).hexdigest()
+    return out
+
+
+def check_schema(module, db):
+    """Verify the users table and, with schema=migrate, bring it up to date.
+
+    Under check mode nothing is migrated; the changes are only reported.
+    """
+    changes = db.schema_changes()
+    migrate = module.params["schema"] == "migrate" and not module.check_mode
+    if changes and migrate:
+        if any(d.startswith("add index users_username") for d, _ in changes):
+            duplicates = db.duplicate_usernames()
+            if duplicates:
+                module.fail_json(
+                    msg="Cannot add a unique index on users.username, "
+                    f"duplicate usernames: {', '.join(duplicates)}",
+                    schema=dict(changes=[d for d, _ in changes], migrated=False),
+                )
+        db.migrate_schema(changes)
+    return dict(changes=[d for d, _ in changes], migrated=bool(changes and migrate))
+
+
+def snapshot(module, conf_vars, db, timings):
+    users_dir = conf_vars["ftp_users_dir"]
+    out = {}
+    readable = True
+    if module.params["schema"] != "ignore":
+        with timings.step("schema"):
+            out["schema"] = check_schema(module, db)
+        blocking = [
+            d for d in out["schema"]["changes"] if d in SCHEMA_BLOCKING
+        ]
+        if blocking and not out["schema"]["migrated"]:
+            if not module.check_mode:
+                module.fail_json(
+                    msg=f"users table is not usable ({', '.join(blocking)}), "
+                    "run with schema=migrate",
+                    **out
+                )
+            # A check-mode preview of a migration: nothing can be read yet.
+            readable = False
+    with timings.step("database"):
+        out["rows"] = db.select_users(module.params["usernames"]) if readable else {}
+        if module.params["inventory"]:
+            out["accounts"] = db.list_accounts() if readable else {}
+    with timings.step("filesystem"):
+        manifest = config_manifest(
+            users_dir, module.params["usernames"], module.params["inventory"]
+        )
+        out["files"] = {
+            name: manifest.get(name) for name in module.params["usernames"]
+        }
+        out["webroots"] = {
+            path: stat_path(local_path(path)) for path in module.params["webroots"]
+        }
+        if module.params["inventory"]:
+            out["config_files"] = sorted(manifest)
+        if module.check_mode and module.params["webroot_repair"]:
+            uid, gid = guest_ids(module, conf_vars["ftp_guest_user"])
+            out["repairs"] = {
+                path: repair_tree(local_path(path), uid, gid, dry_run=True)
+                for path in module.params["webroots"]
+            }
+        # Same test as seed_skeleton's O_EXCL: any entry, even a dangling
+        # symlink, keeps a skeleton file from being written.
+        out["skeleton_missing"] = {
+            path: [
+                name
+                for name in names
+                if not os.path.lexists(os.path.join(local_path(path), name))
+            ]
+            for path, names in module.params["skeletons"].items()
+        }
+    return out
+
+
+def apply(module, conf_vars, db, timings):
+    guest = conf_vars["ftp_guest_user"]
+    users_dir = conf_vars["ftp_users_dir"]
+    users = module.params["users"]
+    per_user = {
+        u["username"]: dict(database=False, webroot=False, user_config=False)
+        for u in users
+    }
+
+    remove = module.params["remove"]
+    removed = {name: dict(database=False, user_config=False) for name in remove}
+    repair = module.params["webroot_repair"]
+    repaired = seeded = 0
+    if repair or any(u["skeleton"] for u in users):
+        uid, gid = guest_ids(module, guest)
+
+    credentials = [
+        (u["username"], u["password_hash"]) for u in users if u["password_hash"]
+    ]
+    def write_rows():
+        with timings.step("database"), db.transaction():
+            if credentials:
+                db.upsert_users(credentials)
+            return db.remove_users(remove, module.params["absent_mode"])
+
+    # The row changes and the filesystem steps do not depend on each other:
+    # the transaction runs on a worker thread (the socket I/O releases the
+    # GIL) while this thread does the webroots and vsftpd files, so the run
+    # takes about as long as the slower of the two. Leaving the with block
+    # waits for the transaction, and its errors surface from result().
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        rows_future = pool.submit(write_rows) if credentials or remove else None
+
+        with timings.step("webroot"):
+            for u in users:
+                webroot = local_path(u["webroot"])
+                changed = ensure_directory(module, webroot, guest, 0o755)
+                if u["skeleton"]:
+                    count = seed_skeleton(webroot, u["skeleton"], uid, gid)
+                    seeded += count
+                    changed = changed or count > 0
+                if repair:
+                    count = repair_tree(webroot, uid, gid)
+                    repaired += count
+                    changed = changed or count > 0
+                per_user[u["username"]]["webroot"] = changed
+
+        with timings.step("user_config"):
+            for name in remove:
+                # Names coming from the users table may not be plain file names.
+                if os.path.basename(name) == name and name not in (".", ".."):
+                    path = os.path.join(users_dir, name)
+                    removed[name]["user_config"] = remove_file(path)
+
+            if not os.path.isdir(users_dir):
+                os.makedirs(users_dir, mode=0o755)
+            for u in users:
+                # None: the controller found the file up to date.
+                if u["user_config"] is None:
+                    continue
+                per_user[u["username"]]["user_config"] = write_file(
+                    module,
+                    os.path.join(users_dir, u["username"]),
+                    u["user_config"],
+                    guest,
+                    0o644,
+                )
+
+        removed_rows = rows_future.result() if rows_future else set()
+
+    for username, _ in credentials:
+        per_user[username]["database"] = True
+    for username in removed_rows:
+        removed[username]["database"] = True
+
+    out = dict(users=per_user, removed=removed)
+    if module.params["userdb"]:
+        with timings.step("userdb"):
+            out["userdb"] = export_userdb(
+                module, module.params["userdb"], db.active_credentials()
+            )
+            service = module.params["userdb_pam_service"]
+            if service:
+                service_changed = write_userdb_service(
+                    module, service, module.params["userdb"]
+                )
+                out["userdb"]["changed"] |= service_changed
+                out["userdb"]["pam_service"] = dict(
+                    name=service,
+                    changed=service_changed,
+                    in_use=conf_vars["pam_service_name"] == service,
+                )
+
+    steps = dict(
+        database=dict(
+            changed=bool(credentials),
+            rows=len(credentials),
+            statements=db.statements,
+        ),
+        webroot=dict(
+            changed=sum(p["webroot"] for p in per_user.values()),
+            repaired=repaired,
+            seeded=seeded,
+        ),
+        user_config=dict(
+            changed=sum(p["user_config"] for p in per_user.values()),
+            sent=sum(u["user_config"] is not None for u in users),
+        ),
+        remove=dict(
+            database=sum(r["database"] for r in removed.values()),
+            user_config=sum(r["user_config"] for r in removed.values()),
+        ),
+    )
+    out["steps"] = steps
+    return out
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            mode=dict(
+                type="str", default="snapshot", choices=["snapshot", "apply"]
+            ),
+            vsftpd_conf=dict(type="path", default="/etc/vsftpd/vsftpd.conf"),
+            pam_dir=dict(type="path", default="/etc/pam.d"),
+            db_pam_service=dict(type="str"),
+            usernames=dict(type="list", elements="str", default=[]),
+            webroots=dict(type="list", elements="str", default=[]),
+            skeletons=dict(type="dict", default={}),
+            inventory=dict(type="bool", default=False),
+            webroot_repair=dict(type="bool", default=False),
+            userdb=dict(type="path"),
+            userdb_pam_service=dict(type="str"),
+            schema=dict(
+                type="str", default="ignore", choices=["ignore", "verify", "migrate"]
+            ),
+            remove=dict(type="list", elements="str", default=[]),
+            absent_mode=dict(
+                type="str", default="delete", choices=["delete", "deactivate"]
+            ),
+            users=dict(
+                type="list",
+                elements="dict",
+                default=[],
+                options=dict(
+                    username=dict(type="str", required=True),
+                    webroot=dict(type="str", required=True),
+                    password_hash=dict(type="str", no_log=True),
+                    user_config=dict(type="str"),
+                    skeleton=dict(type="dict", default={}),
+                ),
+            ),
+        ),
+        supports_check_mode=True,
+    )
+
+    if module.check_mode and module.params["mode"] == "apply":
+        module.exit_json(changed=False, skipped=True, msg="apply skipped in check mode")
+
+    if pymysql is None:
+        module.fail_json(
+            msg=missing_required_lib("PyMySQL"), exception=PYMYSQL_IMPORT_ERROR
+        )
+
+    timings = Timings()
+    try:
+        with timings.step("config"):
+            conf_vars = gather_configuration_vars(
+                module.params["vsftpd_conf"],
+                module.params["pam_dir"],
+                module.params["db_pam_service"],
+            )
+    except ConfigVarMissing as ex:
+        module.fail_json(
+            msg=f"Missing '{ex.key}' in {ex.source}",
+            config_missing=ex.key,
+            source=ex.source,
+        )
+    except OSError as ex:
+        module.fail_json(msg=f"Cannot read configuration: {ex}")
+
+    public_conf = {
+        k: v for k, v in conf_vars.items() if k not in PRIVATE_CONF_KEYS
+    }
+
+    db = Database(conf_vars)
+    try:
+        if module.params["mode"] == "snapshot":
+            out = snapshot(module, conf_vars, db, timings)
+        else:
+            out = apply(module, conf_vars, db, timings)
+    except pymysql.Error as ex:
+        module.fail_json(
+            msg=f"Database error: {ex}", exception=traceback.format_exc()
+        )
+    except OSError as ex:
+        module.fail_json(msg=str(ex), exception=traceback.format_exc())
+    finally:
+        db.close()
+
+    changed = out.get("userdb", {}).get("changed", False) or any(
+        any(p.values())
+        for p in list(out.get("users", {}).values())
+        + list(out.get("removed", {}).values())
+    )
+    module.exit_json(
+        changed=changed,
+        conf=public_conf,
+        timings=dict(timings),
+        db_statements=db.statements,
+        **out
+    )
+
+
+if __name__ == "__main__":
+    main()
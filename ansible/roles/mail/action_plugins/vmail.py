@@ -0,0 +1,155 @@
+"""
+Add virtual mail domains and mailboxes to Postfix, the batched counterpart
+of postfix/add_domain.sh and postfix/add_mailbox.sh (map part only).
+
+    - vmail:
+        domains: [example.com]
+        mailboxes:
+          - info@example.com
+          - {domain: example.org, local: sales}
+        create_maildir: true
+
+A mailbox implies its domain. All maps are updated in one run of the
+``vmail_provision`` module in the role's library/, which runs postmap at most
+once per map however many entries the task adds.
+"""
+
+import re
+import time
+
+from ansible.errors import AnsibleActionFail
+from ansible.plugins.action import ActionBase
+
+# Companion module in the role's library/ doing all host-side work.
+PROVISION_MODULE = "vmail_provision"
+
+# Optional task args handed to the companion module unchanged.
+PASSTHROUGH_ARGS = [
+    "postfix_dir",
+    "map_mode",
+    "create_maildir",
+    "vmail_base",
+    "vmail_user",
+]
+
+DOMAIN_PAT = re.compile(r"(?=.{1,253}$)[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)+")
+# Dot-atom (RFC 5322): no leading, trailing or doubled dots, so never "." or
+# "..", which would escape the domain's directory under vmail_base.
+LOCAL_PAT = re.compile(r"(?=.{1,64}$)[A-Za-z0-9_+-]+(\.[A-Za-z0-9_+-]+)*")
+
+
+def _safe_domain(s) -> str:
+    if not isinstance(s, str) or not DOMAIN_PAT.fullmatch(s):
+        raise AnsibleActionFail(message=f"Invalid domain: {s}")
+    return s.lower()
+
+
+def _safe_local(s) -> str:
+    if not isinstance(s, str) or not LOCAL_PAT.fullmatch(s):
+        raise AnsibleActionFail(message=f"Invalid mailbox local part: {s}")
+    return s
+
+
+class ActionModule(ActionBase):
+    """Provision Postfix virtual domains and mailboxes in one go."""
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+        args = self._task.args
+        started = time.monotonic()
+
+        try:
+            domains, mailboxes = self._normalize(args)
+            module_args = dict(domains=domains, mailboxes=mailboxes)
+            for key in PASSTHROUGH_ARGS:
+                if key in args:
+                    module_args[key] = args[key]
+            exec_result = self._execute_module(
+                module_name=PROVISION_MODULE,
+                module_args=module_args,
+                task_vars=task_vars,
+            )
+            if exec_result.get("failed"):
+                result.update(exec_result)
+                raise AnsibleActionFail(message=result.get("msg"), result=result)
+
+            rebuilt = sum(step["postmap"] for step in exec_result["steps"].values())
+            result.update(
+                changed=exec_result["changed"],
+                domains=[
+                    dict(domain=d, changed=exec_result["domains"][d]) for d in domains
+                ],
+                mailboxes=[
+                    dict(
+                        address=address,
+                        changed=any(exec_result["mailboxes"][address].values()),
+                    )
+                    for address in (f"{m['local']}@{m['domain']}" for m in mailboxes)
+                ],
+                steps=exec_result["steps"],
+                timings=exec_result["timings"],
+                msg=f"{len(domains)} domains, {len(mailboxes)} mailboxes, "
+                f"postmap run on {rebuilt} maps",
+            )
+            if self._task.diff:
+                result["diff"] = exec_result.get("diff", [])
+
+        except AnsibleActionFail as ex:
+            result.setdefault("failed", True)
+            result.setdefault("msg", ex.message)
+
+        result["total_seconds"] = time.monotonic() - started
+        return result
+
+    def _normalize(self, args):
+        """Return ``(domains, mailboxes)`` with every mailbox domain included.
+
+        Mailboxes may be given as ``local@domain`` strings or as dicts with
+        ``domain`` and ``local``; a single ``domain`` + ``local`` pair is a
+        batch of one, like add_mailbox.sh.
+        """
+        if "domains" in args or "mailboxes" in args:
+            raw_domains = args.get("domains", [])
+            raw_mailboxes = args.get("mailboxes", [])
+        elif "domain" in args:
+            raw_domains = [args["domain"]]
+            raw_mailboxes = (
+                [dict(domain=args["domain"], local=args["local"])]
+                if "local" in args
+                else []
+            )
+        else:
+            raise AnsibleActionFail(
+                message="Missing required args: domains/mailboxes or domain"
+            )
+        if not isinstance(raw_domains, list) or not isinstance(raw_mailboxes, list):
+            raise AnsibleActionFail(message="'domains' and 'mailboxes' must be lists")
+
+        mailboxes = []
+        seen = set()
+        for idx, item in enumerate(raw_mailboxes):
+            if isinstance(item, str) and "@" in item:
+                local, _, domain = item.rpartition("@")
+            elif isinstance(item, dict) and "domain" in item and "local" in item:
+                local, domain = item["local"], item["domain"]
+            else:
+                raise AnsibleActionFail(
+                    message=f"mailboxes[{idx}] must be 'local@domain' or "
+                    "a dict with domain and local"
+                )
+            box = dict(domain=_safe_domain(domain), local=_safe_local(local))
+            address = f"{box['local']}@{box['domain']}"
+            if address in seen:
+                raise AnsibleActionFail(message=f"Duplicate mailbox: {address}")
+            seen.add(address)
+            mailboxes.append(box)
+
+        # dict keeps the first-seen order and drops duplicates.
+        domains = list(
+            dict.fromkeys(
+                [_safe_domain(d) for d in raw_domains]
+                + [box["domain"] for box in mailboxes]
+            )
+        )
+        return domains, mailboxes
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+"""
+Remote half of the `vmail` action plugin.
+
+Adds virtual mail domains and mailboxes to the Postfix lookup tables in one
+module execution:
+
+    vmail_domains   "<domain> OK"
+    vmail_mailbox   "<local>@<domain> <domain>/<local>/"
+
+Each map is read once into an index, entries that are missing are appended
+and entries with a different value are rewritten in place. A map is written
+at most once (atomically) and postmap runs at most once per map, only when
+the map changed or its .db is missing or older than the source. With
+create_maildir the Maildir of every mailbox is created as well.
+
+Supports check mode: nothing is written and the result says what would be.
+"""
+
+import os
+import pwd
+import tempfile
+import time
+from contextlib import contextmanager
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils._text import to_bytes, to_text
+
+DOMAINS_MAP = "vmail_domains"
+MAILBOX_MAP = "vmail_mailbox"
+
+
+class Timings(dict):
+    """Monotonic seconds spent per step, returned as ``timings``."""
+
+    @contextmanager
+    def step(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self[name] = self.get(name, 0.0) + time.monotonic() - start
+
+
+class PostfixMap:
+    """A Postfix lookup table source file, loaded once and edited in memory.
+
+    Comments, blank lines and the order of existing entries are kept;
+    ``index`` maps each key to the line of its first occurrence, which is
+    the one postmap keeps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, "rb") as f:
+                self.lines = to_text(f.read()).splitlines()
+            self.exists = True
+        except FileNotFoundError:
+            self.lines = []
+            self.exists = False
+        self.index = {}
+        for lineno, line in enumerate(self.lines):
+            fields = line.split(None, 1)
+            if fields and not fields[0].startswith("#"):
+                self.index.setdefault(fields[0], lineno)
+        self.added = []
+        self.modified = []
+
+    def ensure(self, key, value):
+        """Make ``key`` map to ``value``; return True if that is a change."""
+        line = f"{key} {value}"
+        lineno = self.index.get(key)
+        if lineno is None:
+            self.index[key] = len(self.lines)
+            self.lines.append(line)
+            self.added.append(key)
+            return True
+        if self.lines[lineno].split(None, 1)[1:] == [value]:
+            return False
+        self.lines[lineno] = line
+        self.modified.append(key)
+        return True
+
+    @property
+    def changed(self):
+        return bool(self.added or self.modified)
+
+    def stale(self):
+        """True if the compiled ``.db`` is missing or older than the source."""
+        try:
+            return os.stat(self.path + ".db").st_mtime < os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True
+
+    def write(self, module, mode):
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path), prefix=f".{os.path.basename(self.path)}-"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(to_bytes("\n".join(self.lines) + "\n"))
+            module.atomic_move(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        module.set_mode_if_different(self.path, mode, True)
+
+
+def ensure_maildir(path, uid, gid):
+    """Create the Maildir ``path`` and any missing parents for vmail.
+
+    Only directories created here are chowned; existing ones are left alone.
+    """
+    missing = []
+    parent = os.path.dirname(path)
+    while parent and not os.path.isdir(parent):
+        missing.insert(0, parent)
+        parent = os.path.dirname(parent)
+    created = []
+    for directory in missing + [path] + [
+        os.path.join(path, sub) for sub in ("cur", "new", "tmp")
+    ]:
+        if not os.path.isdir(directory):
+            os.mkdir(directory, 0o700)
+            created.append(directory)
+    for directory in created:
+        os.chown(directory, uid, gid)
+    return bool(created)
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            domains=dict(type="list", elements="str", default=[]),
+            mailboxes=dict(
+                type="list",
+                elements="dict",
+                default=[],
+                options=dict(
+                    domain=dict(type="str", required=True),
+                    local=dict(type="str", required=True),
+                ),
+            ),
+            postfix_dir=dict(type="path", default="/etc/postfix"),
+            map_mode=dict(type="raw", default="0640"),
+            create_maildir=dict(type="bool", default=False),
+            vmail_base=dict(type="path", default="/var/vmail"),
+            vmail_user=dict(type="str", default="vmail"),
+        ),
+        supports_check_mode=True,
+    )
+    params = module.params
+    timings = Timings()
+
+    with timings.step("load"):
+        maps = {
+            name: PostfixMap(os.path.join(params["postfix_dir"], name))
+            for name in (DOMAINS_MAP, MAILBOX_MAP)
+        }
+
+    with timings.step("index"):
+        domains = {
+            domain: maps[DOMAINS_MAP].ensure(domain, "OK")
+            for domain in params["domains"]
+        }
+        mailboxes = {}
+        for box in params["mailboxes"]:
+            address = f"{box['local']}@{box['domain']}"
+            mailboxes[address] = dict(
+                map=maps[MAILBOX_MAP].ensure(
+                    address, f"{box['domain']}/{box['local']}/"
+                ),
+                maildir=False,
+            )
+
+    postmap = None
+    steps = {}
+    try:
+        for name, pmap in maps.items():
+            rebuild = pmap.changed or (pmap.exists and pmap.stale())
+            steps[name] = dict(
+                added=len(pmap.added), modified=len(pmap.modified), postmap=rebuild
+            )
+            if module.check_mode:
+                continue
+            with timings.step("write"):
+                if pmap.changed:
+                    pmap.write(module, params["map_mode"])
+            with timings.step("postmap"):
+                if rebuild:
+                    postmap = postmap or module.get_bin_path("postmap", required=True)
+                    module.run_command([postmap, pmap.path], check_rc=True)
+
+        if params["create_maildir"]:
+            with timings.step("maildir"):
+                if not module.check_mode:
+                    try:
+                        vmail = pwd.getpwnam(params["vmail_user"])
+                    except KeyError:
+                        module.fail_json(
+                            msg=f"vmail user '{params['vmail_user']}' does not exist"
+                        )
+                for box in params["mailboxes"]:
+                    address = f"{box['local']}@{box['domain']}"
+                    path = os.path.join(
+                        params["vmail_base"], box["domain"], box["local"]
+                    )
+                    if module.check_mode:
+                        mailboxes[address]["maildir"] = not os.path.isdir(
+                            os.path.join(path, "new")
+                        )
+                    else:
+                        mailboxes[address]["maildir"] = ensure_maildir(
+                            path, vmail.pw_uid, vmail.pw_gid
+                        )
+    except OSError as ex:
+        module.fail_json(msg=str(ex), steps=steps)
+
+    diff = [
+        dict(
+            before_header=pmap.path,
+            after_header=pmap.path,
+            before="",
+            after="".join(
+                f"{pmap.lines[pmap.index[key]]}\n" for key in pmap.added + pmap.modified
+            ),
+        )
+        for pmap in maps.values()
+        if pmap.changed
+    ]
+    module.exit_json(
+        changed=any(s["postmap"] for s in steps.values())
+        or any(any(m.values()) for m in mailboxes.values()),
+        domains=domains,
+        mailboxes=mailboxes,
+        steps=steps,
+        timings=dict(timings),
+        diff=diff,
+    )
+
+
+if __name__ == "__main__":
+    main()
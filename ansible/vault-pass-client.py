@@ -0,0 +1 @@
+./vault-pass.py
\ No newline at end of file
@@ -2,11 +2,32 @@
 """
 Retrieve an Ansible Vault password from the system keyring using libsecret.
 
+One script serves every vault identity. Ansible runs it as a vault client
+script (any name ending in "-client") and passes --vault-id; under any other
+name the id comes from the file name, e.g. vault-pass-dev.py -> dev.
+
 Usage:
     secret-tool store --label='ansible-vault-dev' \
         xdg:schema org.freedesktop.Secret.Generic ansible-vault-attr ansible-vault-dev
+
+Set ANSIBLE_VAULT_PASS_CACHE_TTL=<seconds> to keep the password in the kernel
+user keyring for that long, so later runs skip the D-Bus lookup (and any
+keyring unlock prompt). The cached key is only readable by the same uid and
+the kernel drops it once the TTL expires. Drop it early after rotating the
+secret with:
+    keyctl purge user ansible-vault:ansible-vault-dev
+
+Looking up every identity at once needs the cache: with
+ANSIBLE_VAULT_PASS_CACHE_TTL set, a miss also looks up the other identities
+in vault_identity_list that point at this script, from the same process (so
+the keyring is unlocked at most once), and the processes Ansible starts for
+them hit the cache. That is still one lookup per identity. Without the
+cache, Ansible starts one process per identity and each does its own lookup.
 """
 
+import argparse
+import configparser
+import functools
 import os
 import sys
 import ctypes as ct
@@ -15,16 +36,22 @@ import ctypes.util
 
 def main():
     vault_id = get_vault_id()
-    account_id_attr_value = f"ansible-vault-{vault_id}".encode()
-    schema = build_schema()
-    password = lookup_password(schema, account_id_attr_value)
+    account_id_attr_value = account(vault_id)
+    ttl = cache_ttl()
+    password = cache_lookup(account_id_attr_value) if ttl else None
+    if password is None:
+        schema = build_schema()
+        password = lookup_password(schema, account_id_attr_value)
+        if ttl:
+            cache_store(account_id_attr_value, password, ttl)
+            for sibling in sibling_vault_ids(vault_id):
+                sibling_password = lookup_password(
+                    schema, account(sibling), required=False
+                )
+                if sibling_password is not None:
+                    cache_store(account(sibling), sibling_password, ttl)
     print(password)
 
-libsecret_path = ctypes.util.find_library("secret-1")
-if not libsecret_path:
-    raise OSError("libsecret not found — install libsecret or equivalent")
-libsecret = ct.CDLL(libsecret_path)
-
 
 SECRET_SCHEMA_NONE = 0
 SECRET_SCHEMA_ATTRIBUTE_STRING = 0
@@ -46,12 +73,20 @@ class SecretSchema(ct.Structure):
     ]
 
 
-libsecret.secret_password_lookup_sync.argtypes = [
-    ct.POINTER(SecretSchema),  # schema
-    ct.c_void_p,  # cancellable
-    ct.c_void_p,  # error
-]
-libsecret.secret_password_lookup_sync.restype = ct.c_char_p
+@functools.cache
+def load_libsecret():
+    # Loaded on first use only: a cache hit never touches libsecret or D-Bus.
+    libsecret_path = ctypes.util.find_library("secret-1")
+    if not libsecret_path:
+        raise OSError("libsecret not found — install libsecret or equivalent")
+    libsecret = ct.CDLL(libsecret_path)
+    libsecret.secret_password_lookup_sync.argtypes = [
+        ct.POINTER(SecretSchema),  # schema
+        ct.c_void_p,  # cancellable
+        ct.c_void_p,  # error
+    ]
+    libsecret.secret_password_lookup_sync.restype = ct.c_char_p
+    return libsecret
 
 
 def build_schema() -> SecretSchema:
@@ -65,17 +100,126 @@ def build_schema() -> SecretSchema:
     return schema
 
 
+CACHE_TTL_ENV = "ANSIBLE_VAULT_PASS_CACHE_TTL"
+KEY_SPEC_USER_KEYRING = -4
+# Possessor: everything; same uid: view, read and search.
+KEY_PERM = 0x3F000000 | 0x00010000 | 0x00020000 | 0x00080000
+
+
+def cache_ttl() -> int:
+    try:
+        return max(0, int(os.environ.get(CACHE_TTL_ENV, "0")))
+    except ValueError:
+        return 0
+
+
+def load_keyutils():
+    path = ctypes.util.find_library("keyutils")
+    if not path:
+        return None
+    keyutils = ct.CDLL(path, use_errno=True)
+    keyutils.keyctl_search.argtypes = [ct.c_int32, ct.c_char_p, ct.c_char_p, ct.c_int32]
+    keyutils.keyctl_search.restype = ct.c_long
+    keyutils.keyctl_read_alloc.argtypes = [ct.c_int32, ct.POINTER(ct.c_void_p)]
+    keyutils.keyctl_read_alloc.restype = ct.c_long
+    keyutils.add_key.argtypes = [
+        ct.c_char_p, ct.c_char_p, ct.c_void_p, ct.c_size_t, ct.c_int32
+    ]
+    keyutils.add_key.restype = ct.c_int32
+    keyutils.keyctl_setperm.argtypes = [ct.c_int32, ct.c_uint32]
+    keyutils.keyctl_setperm.restype = ct.c_long
+    keyutils.keyctl_set_timeout.argtypes = [ct.c_int32, ct.c_uint]
+    keyutils.keyctl_set_timeout.restype = ct.c_long
+    return keyutils
+
+
+def cache_description(account: bytes) -> bytes:
+    return b"ansible-vault:" + account
+
+
+def cache_lookup(account: bytes):
+    keyutils = load_keyutils()
+    if not keyutils:
+        return None
+    key = keyutils.keyctl_search(
+        KEY_SPEC_USER_KEYRING, b"user", cache_description(account), 0
+    )
+    if key < 0:
+        return None
+    buf = ct.c_void_p()
+    size = keyutils.keyctl_read_alloc(key, ct.byref(buf))
+    if size < 0:
+        return None
+    try:
+        return ct.string_at(buf, size).decode()
+    finally:
+        ct.CDLL(None).free(buf)
+
+
+def cache_store(account: bytes, password: str, ttl: int) -> None:
+    # A cache that cannot be written is not an error: the password is
+    # already in hand and the next run simply asks libsecret again.
+    keyutils = load_keyutils()
+    if not keyutils:
+        return
+    payload = password.encode()
+    key = keyutils.add_key(
+        b"user", cache_description(account), payload, len(payload),
+        KEY_SPEC_USER_KEYRING,
+    )
+    if key < 0:
+        return
+    keyutils.keyctl_setperm(key, KEY_PERM)
+    keyutils.keyctl_set_timeout(key, ttl)
+
+
 def get_vault_id() -> str:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vault-id", help="vault identity to look up")
+    opts = parser.parse_args()
+    if opts.vault_id:
+        return opts.vault_id
     return os.path.basename(sys.argv[0]).removeprefix("vault-pass-").removesuffix(".py")
 
 
-def lookup_password(schema: SecretSchema, account: bytes) -> str:
+def account(vault_id: str) -> bytes:
+    return f"ansible-vault-{vault_id}".encode()
+
+
+def sibling_vault_ids(vault_id: str) -> list:
+    """Other identities whose vault_identity_list source is this script."""
+    identities = os.environ.get("ANSIBLE_VAULT_IDENTITY_LIST")
+    if identities is None:
+        cfg_path = os.environ.get("ANSIBLE_CONFIG") or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "ansible.cfg"
+        )
+        cfg = configparser.ConfigParser(interpolation=None)
+        cfg.read(cfg_path)
+        identities = cfg.get("defaults", "vault_identity_list", fallback="")
+        base = os.path.dirname(os.path.abspath(cfg_path))
+    else:
+        base = os.getcwd()
+
+    me = os.path.realpath(__file__)
+    siblings = []
+    for entry in identities.split(","):
+        other, sep, source = entry.strip().partition("@")
+        if not sep or other == vault_id or other in siblings:
+            continue
+        if os.path.realpath(os.path.join(base, os.path.expanduser(source))) == me:
+            siblings.append(other)
+    return siblings
+
+
+def lookup_password(schema: SecretSchema, account: bytes, required=True):
     err = ct.c_int()
-    pw_ptr = libsecret.secret_password_lookup_sync(
+    pw_ptr = load_libsecret().secret_password_lookup_sync(
         ct.byref(schema), None, ct.byref(err), ATTRIBUTE, account, None
     )
 
     if not pw_ptr or err.value != 0:
+        if not required:
+            return None
         sys.stderr.write(f"No secret found for account '{account.decode()}'\n")
         sys.exit(1)
 